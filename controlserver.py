@@ -0,0 +1,370 @@
+"""
+Project: Grating Tester
+File: controlserver.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Local control server for driving the grating tester from scripts.
+
+The server listens on a local TCP port and speaks JSON lines: each request is one line
+    {"id": 1, "command": "move", "args": {"axis": "x", "position": 2.5}}
+and gets one reply line with the same id holding either "result" or "error". Clients that send "subscribe" also
+receive event lines ({"event": "point", ...}) as results are measured, so a script can follow a queued scan or run
+its own optimisation loop (e.g. Bragg angle alignment) at machine speed.
+
+Commands:
+- connect(instruments=None)       connect 'x', 'y', 'rotation', 'monochromator' and/or 'lockin' (default all)
+- move(axis, position, relative=False)      move 'x' or 'y' (mm) or 'rotation1'/'rotation2' (deg)
+- set_wavelength(wavelength)      move the monochromator (nm)
+- acquire(rate=10000, length=500, autorange=True)   one lock-in reading, returns the signal and its std
+- submit_scan(settings, start=True)     add a scan to the job queue (see jobqueue.JOB_SETTINGS), returns its job id
+- position(), status(), queue(), subscribe()
+
+The server works on the instruments of a rig (see rig.py) and submits scans to a job queue, which is the queue of the
+GUI or of one rig of the orchestrator. Hardware commands take the hardware lock of the rig, so they never interleave
+with a scan or a button press. A command that cannot take the lock within lock_timeout fails with 'Hardware busy'
+rather than waiting for a scan to finish.
+
+Each client has its own writer thread and a bounded queue of messages to send. Events are only queued, never written,
+by the thread that sends them (e.g. the scan), and a client whose queue is full is disconnected, so a client that
+stops reading cannot hold up a scan.
+
+Usage:
+    server = ControlServer(rig, job_queue)
+    server.start()
+
+    client = ControlClient()
+    client.call("set_wavelength", wavelength=850)
+    client.call("move", axis="rotation1", position=12.5)
+    signal = client.call("acquire")['signal']
+
+"""
+import functools
+import json
+import socket
+import socketserver
+from collections import deque
+from contextlib import contextmanager
+from queue import Queue, Full
+from threading import Thread, Lock
+import numpy as np
+
+from jobqueue import ScanJob, JOB_SETTINGS
+
+DEFAULT_PORT = 50100
+ROTATION_AXES = ('rotation1', 'rotation2')
+INSTRUMENTS = ('x', 'y', 'rotation', 'monochromator', 'lockin')
+# messages waiting to be sent to a client before it is disconnected for not reading them
+CLIENT_QUEUE_LENGTH = 1000
+# time (s) allowed for the messages still queued to be written when a client connection closes
+CLOSE_TIMEOUT = 5.0
+
+
+def encode(message):
+    # One JSON line, numpy numbers are sent as floats
+    return (json.dumps(message, default=float) + "\n").encode()
+
+
+class ClientConnection:
+    # Connection to one client, messages are queued and written by a thread of the connection
+    def __init__(self, connection_socket, wfile, queue_length=CLIENT_QUEUE_LENGTH):
+        self.socket = connection_socket
+        self.wfile = wfile
+        self.messages = Queue(queue_length)
+        self.closed = False
+        self.writer = Thread(target=self.write_messages, daemon=True)
+        self.writer.start()
+
+    def write_messages(self):
+        while True:
+            message = self.messages.get()
+            if message is None:
+                return
+            try:
+                self.wfile.write(message)
+                self.wfile.flush()
+            except (OSError, ValueError):
+                self.disconnect()
+                return
+
+    def send(self, message):
+        # Queue a message without waiting, returns False if the client has been disconnected
+        if self.closed:
+            return False
+        try:
+            self.messages.put_nowait(message)
+        except Full:
+            # the client is not reading its messages
+            self.disconnect()
+            return False
+        return True
+
+    def disconnect(self):
+        self.closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        # Stop the writer once the queued messages have been written and wait for it, so that the replies are sent
+        # before the socket is closed. A client that is not reading within the timeout is disconnected
+        try:
+            self.messages.put_nowait(None)
+        except Full:
+            self.disconnect()
+        self.writer.join(timeout)
+        if self.writer.is_alive():
+            self.disconnect()
+
+
+class ControlServer:
+    def __init__(self, rig, job_queue=None, start_queue=None, host="127.0.0.1", port=DEFAULT_PORT, lock_timeout=1.0,
+                 queue_length=CLIENT_QUEUE_LENGTH):
+        # rig holds the instruments, job_queue takes the scans submitted (scan commands fail without one) and
+        # start_queue() starts it, by default running the scans on the rig
+        self.rig = rig
+        self.job_queue = job_queue
+        self.start_queue = start_queue or self.run_queue
+        self.address = (host, port)
+        self.lock_timeout = lock_timeout
+        self.queue_length = queue_length
+        self.server = None
+        self.subscribers = set()    # connections of the subscribed clients
+        self.subscribers_lock = Lock()
+        self.commands = {'connect': self.connect, 'move': self.move, 'set_wavelength': self.set_wavelength,
+                         'acquire': self.acquire, 'submit_scan': self.submit_scan, 'position': self.position,
+                         'status': self.status, 'queue': self.queue}
+
+    def start(self):
+        # Serve clients in background threads, returns the address the server is listening on
+        control = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                control.serve_client(self.request, self.rfile, self.wfile)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(self.address, Handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def serve_client(self, connection_socket, rfile, wfile):
+        connection = ClientConnection(connection_socket, wfile, self.queue_length)
+        try:
+            for line in rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    request_id = request.get('id')
+                except (ValueError, AttributeError):
+                    request, request_id = None, None
+                if request is None:
+                    reply = {'id': None, 'error': "Invalid request"}
+                elif request.get('command') == 'subscribe':
+                    with self.subscribers_lock:
+                        self.subscribers.add(connection)
+                    reply = {'id': request_id, 'result': True}
+                else:
+                    reply = self.handle(request)
+                if not connection.send(encode(reply)):
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.subscribers_lock:
+                self.subscribers.discard(connection)
+            connection.close()
+
+    def handle(self, request):
+        # Run one command, errors are returned to the client rather than raised
+        request_id = request.get('id')
+        command = self.commands.get(request.get('command'))
+        if command is None:
+            return {'id': request_id, 'error': f"Unknown command: {request.get('command')}"}
+        try:
+            return {'id': request_id, 'result': command(**request.get('args', {}))}
+        except Exception as error:
+            return {'id': request_id, 'error': f"{type(error).__name__}: {error}"}
+
+    def broadcast(self, event, **data):
+        # Queue an event for the subscribed clients without waiting for them, clients that have gone or are not
+        # keeping up are dropped
+        message = encode(dict(data, event=event))
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for connection in subscribers:
+            if not connection.send(message):
+                with self.subscribers_lock:
+                    self.subscribers.discard(connection)
+
+    def send_message(self, text):
+        # Progress message of a scan for the subscribed clients
+        self.broadcast('message', text=text)
+
+    def send_point(self, job_id, wavelength, x_step, y_step, values):
+        # Point measured by a scan for the subscribed clients, called as the on_point of the scan
+        self.broadcast('point', job_id=job_id, wavelength=wavelength, x=x_step, y=y_step, values=list(values))
+
+    @contextmanager
+    def hardware(self):
+        # Hold the hardware lock for one command
+        if not self.rig.hardware_lock.acquire(timeout=self.lock_timeout):
+            raise RuntimeError("Hardware busy, a scan or another command is using the instruments")
+        try:
+            yield
+        finally:
+            self.rig.hardware_lock.release()
+
+    def connect(self, instruments=None):
+        rig = self.rig
+        instruments = INSTRUMENTS if instruments is None else instruments
+        unknown = set(instruments) - set(INSTRUMENTS)
+        if unknown:
+            raise ValueError(f"Unknown instruments: {sorted(unknown)}")
+        with self.hardware():
+            if 'x' in instruments:
+                rig.x_stage.connect()
+            if 'y' in instruments:
+                rig.y_stage.connect()
+            if 'rotation' in instruments:
+                rig.rotation_stages.refresh()
+            if 'monochromator' in instruments:
+                rig.monochromator.connect()
+            if 'lockin' in instruments:
+                rig.lockin.connect()
+                rig.lockin.configure({'fast_buffer.enabled': True})
+        return list(instruments)
+
+    def move(self, axis, position, relative=False):
+        # Move a stage, returns its new position. Rotation moves wait until the stage has stopped
+        rig = self.rig
+        with self.hardware():
+            if axis in ('x', 'y'):
+                stage = rig.x_stage if axis == 'x' else rig.y_stage
+                if relative:
+                    stage.move_by(float(position))
+                else:
+                    stage.move_to(float(position))
+                return stage.position()
+            if axis not in ROTATION_AXES:
+                raise ValueError(f"Unknown axis: {axis}")
+            index = ROTATION_AXES.index(axis)
+            if relative:
+                rig.rotation_stages.move_by(index, float(position), blocking=True)
+            else:
+                rig.rotation_stages.move_to(index, float(position), blocking=True)
+            return rig.rotation_stages.position(index)
+
+    def set_wavelength(self, wavelength):
+        with self.hardware():
+            self.rig.monochromator.goto(float(wavelength))
+        return self.rig.monochromator.wavelength
+
+    def acquire(self, rate=10000, length=500, autorange=True):
+        rig = self.rig
+        with self.hardware():
+            x, = rig.lockin.acquire_ranged(int(rate), int(length), autorange=autorange)
+        signal = {'signal': rig.convert_signal(np.mean(x)), 'signal_std': rig.convert_signal(np.std(x)),
+                  'sensitivity': rig.lockin.settings.get('sensitivity'), 'range_status': rig.lockin.range_status}
+        self.broadcast('reading', **signal)
+        return signal
+
+    def position(self):
+        # Cached positions, no instrument is queried
+        rig = self.rig
+        return {'x': rig.x_stage.position(), 'y': rig.y_stage.position(),
+                'wavelength': rig.monochromator.wavelength}
+
+    def jobs(self):
+        # Job queue of the scan commands
+        if self.job_queue is None:
+            raise RuntimeError("No job queue, scans cannot be submitted to this server")
+        return self.job_queue
+
+    def run_queue(self):
+        # Run the queued scans on the rig, their messages are printed and they are streamed to the subscribed clients
+        job_queue = self.jobs()
+        job_queue.start(lambda job: self.rig.run_scan(job, checkpoint=job_queue.checkpoint, output=self.output,
+                                                      on_point=functools.partial(self.send_point, job.job_id)))
+
+    def output(self, message):
+        print(message)
+        self.send_message(message)
+
+    def submit_scan(self, settings, start=True):
+        unknown = set(settings) - set(JOB_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown scan settings: {sorted(unknown)}")
+        job = self.jobs().add(ScanJob(settings))
+        if start:
+            self.start_queue()
+        return job.job_id
+
+    def queue(self):
+        return [job.to_dict() for job in self.jobs().jobs]
+
+    def status(self):
+        rig = self.rig
+        busy = not rig.hardware_lock.acquire(blocking=False)
+        if not busy:
+            rig.hardware_lock.release()
+        status = {'busy': busy, 'position': self.position()}
+        if self.job_queue is not None:
+            current = self.job_queue.current
+            status.update({'queue_running': self.job_queue.is_running(), 'queue_paused': self.job_queue.is_paused(),
+                           'current_job': current.job_id if current else None,
+                           'pending': len(self.job_queue.pending())})
+        return status
+
+
+class ControlClient:
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=None):
+        self.socket = socket.create_connection((host, port), timeout)
+        self.rfile = self.socket.makefile('r')
+        self.next_id = 0
+        self.events = deque()   # events received while waiting for a reply
+
+    def close(self):
+        self.rfile.close()
+        self.socket.close()
+
+    def read(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Control server closed the connection")
+        return json.loads(line)
+
+    def call(self, command, **args):
+        # Send a command and wait for its reply, raises RuntimeError if the command failed
+        self.next_id += 1
+        self.socket.sendall(encode({'id': self.next_id, 'command': command, 'args': args}))
+        while True:
+            message = self.read()
+            if 'event' in message:
+                self.events.append(message)
+            elif message.get('id') == self.next_id:
+                if 'error' in message:
+                    raise RuntimeError(message['error'])
+                return message['result']
+
+    def subscribe(self):
+        return self.call('subscribe')
+
+    def next_event(self):
+        # Next event from the server, waits for one if none have been received
+        if self.events:
+            return self.events.popleft()
+        while True:
+            message = self.read()
+            if 'event' in message:
+                return message
@@ -0,0 +1,120 @@
+"""
+Project: Grating Tester
+File: csvloader.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Fast loader for the CSV result files written by the grating tester.
+
+The archive holds several variants of the result format:
+- the run_experiment format, a comma separated header followed by rows appended with ", " separators
+  (optionally with monitor and ratio columns)
+- the older np.savetxt formats, with the header as a '# ' comment or a plain ", " separated header, and unmeasured
+  points left as rows of zeros
+The header is used to work out which variant a file is and which column is which, then the numbers are parsed in one
+bulk conversion rather than line by line. The rows are reshaped into (x, y, wavelength) cubes with NaN for points
+which were not measured, and whole folders can be converted to the binary cube store in one pass.
+
+Usage:
+    columns = load_csv("20230516-120000_VPHG1.csv")
+    wavelengths, x_steps, y_steps, cubes = to_cube(columns)
+    convert_archive("C:/Users/gooding/Desktop/Automation/Results")
+
+Dependencies:
+- numpy
+
+"""
+import os
+import numpy as np
+
+from resultstore import save_cube, CUBE_SUFFIX
+
+# column names in the order they are written, used when a file has no header
+DEFAULT_COLUMNS = ('wavelength', 'x', 'y', 'signal', 'signal_std')
+# header text (lower case, without units) for each column name
+HEADER_NAMES = {'wavelength': 'wavelength', 'x step': 'x', 'y step': 'y',
+                'signal': 'signal', 'signal std': 'signal_std',
+                'monitor': 'monitor', 'monitor std': 'monitor_std',
+                'ratio': 'ratio', 'ratio std': 'ratio_std'}
+
+
+def column_name(text):
+    # Column name for a header entry, e.g. ' Signal std (mV)' -> 'signal_std'
+    text = text.strip().lstrip('#').split('(')[0].strip().lower()
+    return HEADER_NAMES.get(text, text.replace(' ', '_'))
+
+
+def read_header(text):
+    # Column names and the position of the data in the file text. Returns (names, start of data, variant)
+    first_line, _, rest = text.partition('\n')
+    stripped = first_line.strip()
+    if stripped.startswith('#'):
+        return [column_name(entry) for entry in stripped.split(',')], len(first_line) + 1, 'savetxt'
+    try:
+        [float(entry) for entry in stripped.split(',') if entry.strip()]
+    except ValueError:
+        variant = 'run_experiment' if ', ' not in stripped else 'save_data_csv'
+        return [column_name(entry) for entry in stripped.split(',')], len(first_line) + 1, variant
+    return list(DEFAULT_COLUMNS), 0, 'no_header'
+
+
+def load_csv(path):
+    # Columns of a result file as a dict of arrays, e.g. {'wavelength': ..., 'signal': ...}
+    with open(path) as f:
+        text = f.read()
+    names, start, variant = read_header(text)
+
+    # parse all the numbers at once, separators may be ',' or ', ' and lines may end with '\r\n'
+    values = np.array(text[start:].replace(',', ' ').split(), dtype=float)
+    rows = len(values) // len(names)
+    # a run that was stopped part way through may have an incomplete last row
+    data = values[:rows * len(names)].reshape(rows, len(names))
+
+    if variant in ('savetxt', 'save_data_csv'):
+        # np.savetxt wrote the whole preallocated table, points that were not measured are rows of zeros
+        data = data[np.any(data != 0, axis=1)]
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+
+def to_cube(columns):
+    # Reshape the columns into (x, y, wavelength) cubes with NaN for points that were not measured.
+    # Returns (wavelengths, x_steps, y_steps, cubes) where cubes is a dict of the remaining columns
+    wavelengths, k = np.unique(columns['wavelength'], return_inverse=True)
+    x_steps, i = np.unique(columns['x'], return_inverse=True)
+    y_steps, j = np.unique(columns['y'], return_inverse=True)
+    cubes = {}
+    for name, values in columns.items():
+        if name in ('wavelength', 'x', 'y'):
+            continue
+        cube = np.full((len(x_steps), len(y_steps), len(wavelengths)), np.nan)
+        cube[i, j, k] = values
+        cubes[name] = cube
+    return wavelengths, x_steps, y_steps, cubes
+
+
+def convert_csv(path, overwrite=False):
+    # Convert one result file to a cube next to it, returns the cube path
+    cube_path = os.path.splitext(path)[0] + CUBE_SUFFIX
+    if os.path.exists(cube_path) and not overwrite:
+        return cube_path
+    wavelengths, x_steps, y_steps, cubes = to_cube(load_csv(path))
+    return save_cube(cube_path, wavelengths, x_steps, y_steps, cubes,
+                     {'name': os.path.splitext(os.path.basename(path))[0].partition('_')[2],
+                      'csv': os.path.basename(path)})
+
+
+def convert_archive(folder, overwrite=False):
+    # Convert every result file in a folder to the cube store, returns the paths of the cubes written
+    converted = []
+    for item in sorted(os.scandir(folder), key=lambda item: item.name):
+        if not item.is_file() or not item.name.lower().endswith(".csv"):
+            continue
+        cube_path = os.path.splitext(item.path)[0] + CUBE_SUFFIX
+        if os.path.exists(cube_path) and not overwrite:
+            continue
+        try:
+            converted.append(convert_csv(item.path, overwrite))
+        except (ValueError, KeyError) as error:
+            print(f"Could not convert {item.name}: {error}")
+    return converted
@@ -0,0 +1,74 @@
+"""
+Project: Grating Tester
+File: gainmap.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Per-wavelength sensitivity (gain) map for the lock-in amplifier.
+
+VPHG efficiency changes by orders of magnitude across a band, so no single lock-in sensitivity suits every wavelength
+and auto-ranging at every point is slow. The gain map records the sensitivity that worked at each wavelength for each
+grating in previous runs (gain_map.json in the results folder). The sensitivity is preset from the map while the
+monochromator moves, and the lock-in is only auto-ranged when the data shows an overload or under-range.
+
+Dependencies:
+- numpy
+
+"""
+import json
+import os
+from threading import Lock
+import numpy as np
+
+# rigs running in the same process share the gain map of a results folder
+SAVE_LOCK = Lock()
+
+
+class GainMap:
+    def __init__(self, path=None):
+        # path of the json file holding the map
+        self.path = path
+        self.gains = self.load()    # grating ID -> {wavelength (nm): sensitivity}
+        self.updates = {}   # entries recorded since the map was loaded, in the same form
+        self.changed = False
+
+    def load(self):
+        if not (self.path and os.path.exists(self.path)):
+            return {}
+        with open(self.path) as f:
+            return {grating: {float(wavelength): sensitivity for wavelength, sensitivity in gains.items()}
+                    for grating, gains in json.load(f).items()}
+
+    def lookup(self, grating_id, wavelength, tolerance=None):
+        # Sensitivity recorded at the nearest wavelength for a grating, None if there is none within tolerance (nm)
+        gains = self.gains.get(grating_id)
+        if not gains:
+            return None
+        wavelengths = np.array(list(gains))
+        nearest = wavelengths[np.argmin(np.abs(wavelengths - wavelength))]
+        if tolerance is not None and abs(nearest - wavelength) > tolerance:
+            return None
+        return gains[nearest]
+
+    def record(self, grating_id, wavelength, sensitivity):
+        gains = self.gains.setdefault(grating_id, {})
+        if gains.get(float(wavelength)) != sensitivity:
+            gains[float(wavelength)] = sensitivity
+            self.updates.setdefault(grating_id, {})[float(wavelength)] = sensitivity
+            self.changed = True
+
+    def save(self):
+        # the entries recorded here are merged into the saved map, so runs saving to the same map don't lose entries
+        if self.path and self.changed:
+            with SAVE_LOCK:
+                gains = self.load()
+                for grating, updates in self.updates.items():
+                    gains.setdefault(grating, {}).update(updates)
+                with open(self.path, 'w') as f:
+                    json.dump({grating: {str(wavelength): sensitivity
+                                         for wavelength, sensitivity in sorted(entries.items())}
+                               for grating, entries in gains.items()}, f, indent=1)
+            self.gains = gains
+            self.updates = {}
+            self.changed = False
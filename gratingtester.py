@@ -30,21 +30,37 @@ import numpy as np
 import time
 import os
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 from tqdm import tqdm_notebook as tqdm
 import winsound
 import csv
 import subprocess
+import functools
 
 # hardware packages
-import bendev   # Bentham monochromator
-from slave.transport import Socket
-from slave.signal_recovery import SR7230    # Lock-in amplifier
 from slave.misc import LockInMeasurement
-import thorlabs_apt as apt  # Thorlabs stages
-import serial   # Newmark stages
+from rig import load_bench, RIG_FILE     # instruments of the test bench and the scan engine
+from scanplan import CostModel, format_duration
+from jobqueue import JobQueue, ScanJob, JobSkipped
+from controlserver import ControlServer
 # from py_thorlabs_tsp import ThorlabsTsp01B  # Thorlabs temperature and humidity sensor
 
 
+def uses_hardware(action):
+    # GUI actions that use the instruments are refused while a scan or a remote command is using them,
+    # so that the button press doesn't freeze the GUI or interleave commands with the scan
+    @functools.wraps(action)
+    def wrapper(self, *args, **kwargs):
+        if not self.hardware_lock.acquire(blocking=False):
+            self.output_message("The hardware is busy, wait for the scan to finish.")
+            return None
+        try:
+            return action(self, *args, **kwargs)
+        finally:
+            self.hardware_lock.release()
+    return wrapper
+
+
 class ExperimentGUI:
     def connect_laser(self):
         self.output_text.insert(tk.END, "Connecting to laser...\n")
@@ -55,6 +71,7 @@ class ExperimentGUI:
         self.output_text.see(tk.END)
         self.update_indicator_lights("laser")  # Update the indicator light for the laser
 
+    @uses_hardware
     def connect_monochromator(self):
         self.output_text.insert(tk.END, "Connecting to monochromator...\n")
         # Connect to the monochromator equipment
@@ -64,9 +81,8 @@ class ExperimentGUI:
         #    print(dev.write("SYSTEM:ERR?"))
         #    self.output_text.insert(tk.END, dev.query("*IDN?")+ "\n")
         #    self.output_text.see(tk.END)
-        mono = bendev.Device()
+        mono = self.monochromator.connect()
         print(mono.query("*IDN?"))
-        mono.write("SYSTEM:REMOTE")
         self.output_text.insert(tk.END, mono.query("*IDN?") + "\n")
         # if error, then output error message
         if mono.write("SYSTEM:ERR?") != None:
@@ -76,55 +92,57 @@ class ExperimentGUI:
         self.output_text.see(tk.END)
         self.update_indicator_lights("monochromator")  # Update the indicator light for the monochromator
 
+    @uses_hardware
     def connect_x_translation(self):
         self.output_text.insert(tk.END, "Connecting to X translation stage...\n")
         # Connect to the X translation stage equipment
-        ser_x = serial.Serial('COM4', baudrate=9600, timeout=0)
+        ser_x = self.x_stage.connect()
         print(ser_x.isOpen())
         self.output_text.insert(tk.END, ser_x.isOpen())
         self.output_text.insert(tk.END, "\nX translation stage connected.\n\n")
         self.output_text.see(tk.END)
         self.update_indicator_lights("x_translation")  # Update the indicator light for the X translation stage
 
+    @uses_hardware
     def connect_y_translation(self):
         self.output_text.insert(tk.END, "Connecting to Y translation stage...\n")
         # Connect to the Y translation stage equipment
-        ser_y = serial.Serial('COM5', baudrate=9600, timeout=0)
+        ser_y = self.y_stage.connect()
         print(ser_y.isOpen())
         self.output_text.insert(tk.END, ser_y.isOpen())
         self.output_text.insert(tk.END, "\nY translation stage connected.\n\n")
         self.output_text.see(tk.END)
         self.update_indicator_lights("y_translation")  # Update the indicator light for the Y translation stage
 
+    @uses_hardware
     def connect_rotation1(self):
         self.output_text.insert(tk.END, "Connecting to rotation 1 stage...\n")
         self.output_text.see(tk.END)
         # Connect to the first rotation stage equipment
-        devices = apt.list_available_devices()
-        print(devices)
-        motor1 = apt.Motor(devices[0][1])
-        print("Connected to device #", devices[0][1])
+        print(self.rotation_stages.refresh())
+        print("Connected to device #", self.rotation_stages.serial_number(0))
         self.output_text.insert(tk.END, "Rotation 1 stage connected.\n\n")
         self.output_text.see(tk.END)
         self.update_indicator_lights("rotation1")  # Update the indicator light for rotation 1 stage
 
+    @uses_hardware
     def connect_rotation2(self):
         self.output_text.insert(tk.END, "Connecting to rotation 2 stage...\n")
         self.output_text.see(tk.END)
         # Connect to the second rotation stage equipment
-        devices = apt.list_available_devices()
-        print(devices)
-        motor2 = apt.Motor(devices[1][1])
-        print("Connected to device #", devices[1][1])
+        print(self.rotation_stages.refresh())
+        print("Connected to device #", self.rotation_stages.serial_number(1))
         self.output_text.insert(tk.END, "Rotation 2 stage connected.\n\n")
         self.output_text.see(tk.END)
         self.update_indicator_lights("rotation2")  # Update the indicator light for rotation 2 stage
 
+    @uses_hardware
     def connect_lockin_amplifier(self):
         self.output_text.insert(tk.END, "Connecting to lock-in amplifier...\n")
         # Connect to the lock-in amplifier equipment
-        lockin = SR7230(Socket(address=('169.254.150.230', 50000)))
-        lockin.fast_buffer.enabled = True   # Use fast curve buffer.
+        self.lockin.connect()
+        self.lockin.configure({'fast_buffer.enabled': True})   # Use fast curve buffer.
+        self.lockin.settle_time()   # read the time constant and slope for the run time estimates
         self.output_text.insert(tk.END, "Lock-in amplifier connected.\n\n")
         self.output_text.see(tk.END)
         self.update_indicator_lights("lockin_amplifier")  # Update the indicator light for the lock-in amplifier
@@ -154,14 +172,16 @@ class ExperimentGUI:
     def output_message(self, message):
         # Schedule the update operations to be run on the main thread
         self.output_text.after(0, lambda: (self.output_text.insert(tk.END, message + '\n'), self.output_text.see(tk.END)))
+        # and send the message to the remote control clients
+        if self.server is not None:
+            self.server.send_message(message)
 
+    @uses_hardware
     def set_wavelength(self):
         wavelength = self.wavelength_entry.get()
         if wavelength:
             self.wavelength = float(wavelength)
-            mono = bendev.Device()
-            mono.write("SYSTEM:REMOTE")
-            mono.query("MONO:GOTO? %s" % self.wavelength)
+            self.monochromator.goto(self.wavelength)
             self.output_message(f"Wavelength set to: {self.wavelength} nm")
             self.output_text.see(tk.END)
         else:
@@ -169,341 +189,265 @@ class ExperimentGUI:
             self.output_text.see(tk.END)
 
     def auto_wavelength(self, wavelength):
-        mono = bendev.Device()
-        mono.write("SYSTEM:REMOTE")
-        mono.query("MONO:GOTO? %s" % wavelength)
-
-    def convert_steps(self, step):
-        # TODO: Update this function to convert steps to mm for the translation stages properly
-        # Convert the number of steps to a distance in mm, if zero return zero
-        if step == 0:
-            return 0
-        else:
-            # conversion factor determined experimentally and verified as step size from the manual
-            return float(step) * 8.0645
+        return self.monochromator.goto(wavelength)
 
     def convert_signal(self, signal):
         # TODO: Update this function to convert the signal from the lock-in amplifier to a voltage properly
-        # Convert the signal from the lock-in amplifier to a voltage
-        return float(signal) / 200
+        # Convert the signal from the lock-in amplifier to a voltage, the scaling is a calibration of the rig
+        return self.rig.convert_signal(signal)
 
+    @uses_hardware
     def move_x_abs(self):
-        x_translation_mm = self.x_translation_entry.get()
-        x_translation = self.convert_steps(x_translation_mm)
-        self.output_message(f"X translation set to: {self.x_translation} mm")
+        x_translation = self.x_translation_entry.get()
         if x_translation:
             self.x_translation = float(x_translation)
-            ser_x = serial.Serial('COM4', baudrate=9600, timeout=0)
-            ser_x.write(b'MA ' + str(self.x_translation).encode() + b'\r\n')
+            self.x_stage.move_to(self.x_translation)
             self.output_message(f"X translation set to: {self.x_translation} mm")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid X translation.")
             self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_y_abs(self):
-        y_translation_mm = self.y_translation_entry.get()
-        y_translation = self.convert_steps(y_translation_mm)
+        y_translation = self.y_translation_entry.get()
         if y_translation:
             self.y_translation = float(y_translation)
-            ser_y = serial.Serial('COM5', baudrate=9600, timeout=0)
-            ser_y.write(b'MA ' + str(self.y_translation).encode() + b'\r\n')
+            self.y_stage.move_to(self.y_translation)
             self.output_message(f"Y translation set to: {self.y_translation} mm")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid Y translation.")
             self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_x_rel(self):
         x_translation_mm = self.x_translation_entry.get()
-        x_translation = self.convert_steps(x_translation_mm)
-        if x_translation:
-            self.x_translation = float(x_translation)
-            ser_x = serial.Serial('COM4', baudrate=9600, timeout=0)
-            ser_x.write(b'MR ' + str(self.x_translation).encode() + b'\r\n')
+        if x_translation_mm:
+            self.x_stage.move_by(float(x_translation_mm))
+            self.x_translation = self.x_stage.position()
             self.output_message(f"X translation moved by: {x_translation_mm} mm")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid X translation.")
             self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_y_rel(self):
         y_translation_mm = self.y_translation_entry.get()
-        y_translation = self.convert_steps(y_translation_mm)
-        if y_translation:
-            self.y_translation = float(y_translation)
-            ser_y = serial.Serial('COM5', baudrate=9600, timeout=0)
-            ser_y.write(b'MR ' + str(self.y_translation).encode() + b'\r\n')
-            self.output_message(f"Y translation set to: {y_translation_mm} mm")
+        if y_translation_mm:
+            self.y_stage.move_by(float(y_translation_mm))
+            self.y_translation = self.y_stage.position()
+            self.output_message(f"Y translation moved by: {y_translation_mm} mm")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid Y translation.")
             self.output_text.see(tk.END)
 
     def move_y_auto(self, y_translation):
-        y_translation = self.convert_steps(float(y_translation))
-        ser_y = serial.Serial('COM5', baudrate=9600, timeout=0)
-        ser_y.write(b'MR ' + str(y_translation).encode() + b'\r\n')
+        return self.y_stage.move_by(float(y_translation))
 
     def move_x_auto(self, x_translation):
-        x_translation = self.convert_steps(float(x_translation))
-        ser_x = serial.Serial('COM4', baudrate=9600, timeout=0)
-        ser_x.write(b'MR ' + str(x_translation).encode() + b'\r\n')
+        return self.x_stage.move_by(float(x_translation))
 
+    @uses_hardware
     def zero_x(self):
-        ser_x = serial.Serial('COM4', baudrate=9600, timeout=0)
-        ser_x.write(b'P=0\r\n')
+        self.x_stage.zero()
         self.output_message("X location set to zero")
         self.output_text.see(tk.END)
 
+    @uses_hardware
     def zero_y(self):
-        ser_y = serial.Serial('COM5', baudrate=9600, timeout=0)
-        ser_y.write(b'P=0\r\n')
+        self.y_stage.zero()
         self.output_message("Y location set to zero")
         self.output_text.see(tk.END)
 
     def reset_buffers(self):
-        # Reset the buffers of the lock-in amplifier
-        ser_x = serial.Serial('COM4', baudrate=9600, timeout=0)
-        ser_y = serial.Serial('COM5', baudrate=9600, timeout=0)
-        ser_x.reset_input_buffer()
-        ser_y.reset_input_buffer()
+        # Reset the input buffers of the translation stages
+        self.x_stage.reset_input_buffer()
+        self.y_stage.reset_input_buffer()
 
+    def check_stage_positions(self):
+        # Read the stage positions back from the controllers and report any drift from the cached positions
+        self.rig.check_stage_positions(self.output_message)
+
+    @uses_hardware
     def move_rotation1_abs(self):
         rotation1 = self.rotation1_entry.get()
         if rotation1:
             self.rotation1 = float(rotation1)
-            devices = apt.list_available_devices()
-            motor1 = apt.Motor(devices[0][1])
-            motor1.move_to(self.rotation1/5.5)  # converted to degrees
+            self.rotation_stages.move_to(0, self.rotation1)
             self.output_message(f"Rotation 1 set to: {self.rotation1} degrees")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid Rotation 1.")
             self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_rotation2_abs(self):
         rotation2 = self.rotation2_entry.get()
         if rotation2:
             self.rotation2 = float(rotation2)
-            devices = apt.list_available_devices()
-            motor2 = apt.Motor(devices[1][1])
-            motor2.move_to(self.rotation2/5.5)  # converted to degrees
+            self.rotation_stages.move_to(1, self.rotation2)
             self.output_message(f"Rotation 2 set to: {self.rotation2} degrees")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid Rotation 2.")
             self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_rotation1_rel(self):
         rotation1 = self.rotation1_entry.get()
         if rotation1:
             self.rotation1 = float(rotation1)
-            devices = apt.list_available_devices()
-            motor1 = apt.Motor(devices[0][1])
-            motor1.move_by(self.rotation1/5.5)  # converted to degrees
+            self.rotation_stages.move_by(0, self.rotation1)
             self.output_message(f"Rotation 1 moved by: {self.rotation1} degrees")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid Rotation 1.")
             self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_rotation2_rel(self):
         rotation2 = self.rotation2_entry.get()
         if rotation2:
             self.rotation2 = float(rotation2)
-            devices = apt.list_available_devices()
-            motor2 = apt.Motor(devices[1][1])
-            motor2.move_by(self.rotation2/5.5)  # converted to degrees
+            self.rotation_stages.move_by(1, self.rotation2)
             self.output_message(f"Rotation 2 moved by: {self.rotation2} degrees")
             self.output_text.see(tk.END)
         else:
             self.output_message("Please enter a valid Rotation 2.")
             self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_rotation1_home(self):
-        devices = apt.list_available_devices()
-        motor1 = apt.Motor(devices[0][1])
-        motor1.move_home(True)
+        self.rotation_stages.home(0)
         self.output_message(f"Rotation 1 moved to home.")
         self.output_text.see(tk.END)
 
+    @uses_hardware
     def move_rotation2_home(self):
-        devices = apt.list_available_devices()
-        motor2 = apt.Motor(devices[1][1])
-        motor2.move_home(True)
+        self.rotation_stages.home(1)
         self.output_message(f"Rotation 2 moved to home.")
         self.output_text.see(tk.END)
 
-    def threading(self):
-        # call experiment in a thread so that the GUI doesn't freeze
-        t1=Thread(target=self.run_experiment)
-        t1.start()
+    def job_from_entries(self):
+        # Scan job from the experiment settings, read in the main thread so that the scan thread doesn't use the GUI
+        return ScanJob({'name': self.file_name_entry.get(), 'grating_id': self.grating_id_entry.get(),
+                        'wavelength_start': self.wavelength_start_entry.get(),
+                        'wavelength_stop': self.wavelength_stop_entry.get(),
+                        'wavelength_step': self.wavelength_step_entry.get(),
+                        'x_step_size': self.x_step_size_entry.get(), 'x_step_number': self.x_step_number_entry.get(),
+                        'y_step_size': self.y_step_size_entry.get(), 'y_step_number': self.y_step_number_entry.get(),
+                        'rotation1': self.job_rotation1_entry.get(), 'rotation2': self.job_rotation2_entry.get(),
+                        'root_folder': self.root_folder_entry.get(), 'file_name': self.file_name_entry.get(),
+                        'save_data': self.save_data.get(), 'settle_accuracy': self.settle_accuracy_entry.get(),
+                        'monitor_settling': self.monitor_settling.get(), 'monitor_channel': self.monitor_channel.get(),
+                        'monitor_address': self.monitor_address_entry.get(), 'gain_ranging': self.gain_ranging.get(),
+                        'record_io': self.record_io.get()})
+
+    def check_plan(self, job=None):
+        # Validate the scan plan and show the estimated run time, returns None if the plan cannot be run
+        if job is None:
+            job = self.job_from_entries()
+        try:
+            plan = self.rig.build_plan(job)
+        except ValueError as error:
+            self.output_message(str(error))
+            self.estimate_label.after(0, lambda: self.estimate_label.configure(text="Invalid settings", fg="red"))
+            return None
+        problems = self.rig.validate_plan(plan)
+        for problem in problems:
+            self.output_message(problem)
+        for message in self.rig.unchecked_limits():
+            self.output_message(message)
+        self.cost_model = CostModel(self.rig.timings_file(job['root_folder']))
+        estimate = format_duration(self.cost_model.estimate(plan))
+        text = f"{len(plan)} points, estimated {estimate}"
+        colour = "red" if problems else "black"
+        self.estimate_label.after(0, lambda: self.estimate_label.configure(text=text, fg=colour))
+        self.output_message(f"Scan plan: {text}")
+        if problems:
+            return None
+        return plan
 
-    def run_experiment(self):
-        # clear the output text box
-        self.output_text.insert(tk.END, "\n")
-        self.output_text.insert(tk.END, "\n")
-        self.output_text.insert(tk.END, "Running experiment...\n")
-        self.output_text.see(tk.END)
+    def threading(self):
+        # call experiment in a thread so that the GUI doesn't freeze, a second click doesn't start a second scan
+        if (self.scan_thread is not None and self.scan_thread.is_alive()) or self.queue.is_running():
+            self.output_message("A scan is already running, add the scan to the queue instead.")
+            return
+        self.queue.clear_skip()
+        self.scan_thread = Thread(target=self.run_single, args=(self.job_from_entries(),), daemon=True)
+        self.scan_thread.start()
+
+    def run_single(self, job):
+        # Scan started with the Run button
+        try:
+            self.run_job(job)
+        except JobSkipped:
+            self.output_message("Scan stopped.")
+
+    def run_job(self, job, show_plot=True):
+        # Run one scan, holding the hardware lock so that the buttons and remote commands wait for the scan
+        with self.hardware_lock:
+            return self.run_experiment(job, show_plot)
+
+    def run_queued_job(self, job):
+        # Scan run by the job queue, an invalid scan is marked as failed and the queue moves on
+        self.output_message(f"Queued scan: {job.describe()}")
+        if not self.run_job(job, show_plot=False):
+            raise ValueError("Invalid scan settings")
+
+    def run_experiment(self, job, show_plot=True):
+        # runs in a worker thread, messages go through output_message so that Tk is only used from the main thread
+        self.output_message("\n\nRunning experiment...")
         time.sleep(1)
 
-        # Create csv file to save data
-        if self.save_data.get():
-            self.output_text.insert(tk.END, "Creating csv file...\n")
-            self.output_text.see(tk.END)
-            timestr = time.strftime("%Y%m%d-%H%M%S")
-            filename = f"{self.root_folder_entry.get()}/%s_{self.file_name_entry.get()}.csv" % timestr
-
-            # save header information
-            header_line = "Wavelength (nm),X step (mm),Y step (mm),Signal (mV),Signal std (mV)"
-
-            with open(filename, mode='w', newline='') as csv_file:
-                csv_writer = csv.writer(csv_file)
-                csv_writer.writerow(header_line.split(','))
-            self.output_text.insert(tk.END, f"File created: {filename}\n")
-            self.output_text.see(tk.END)
-
-        # Get the parameters from the GUI
-
-        wavelengths = np.arange(float(self.wavelength_start_entry.get()),
-                                float(self.wavelength_stop_entry.get()),
-                                float(self.wavelength_step_entry.get()))
-        self.output_text.insert(tk.END, f"Wavelengths: {wavelengths}\n")
-
-        # if there are x steps, then create an array of x steps
-        if self.x_step_number_entry.get():
-            x_steps = np.arange(0, (float(self.x_step_size_entry.get()) * float(self.x_step_number_entry.get())),
-                                int(self.x_step_size_entry.get()))
-            self.output_text.insert(tk.END, f"X steps: {x_steps}\n")
-        else:
-            x_steps = np.array([0])
-            self.output_text.insert(tk.END, f"X steps: {x_steps}\n")
-
-        # if there are y steps, then create an array of y steps
-        if self.y_step_number_entry.get():
-            y_steps = np.arange(0, (float(self.y_step_size_entry.get()) * float(self.y_step_number_entry.get())),
-                                int(self.y_step_size_entry.get()))
-            self.output_text.insert(tk.END, f"Y steps: {y_steps}\n")
-        else:
-            y_steps = np.array([0])
-            self.output_text.insert(tk.END, f"Y steps: {y_steps}\n")
+        # check the plan and show the estimated run time before starting
+        if self.check_plan(job) is None:
+            return False
 
-        # sleep for 1 second to allow the user to see the message
-        time.sleep(1)
+        # run the scan on the rig, the queue can pause or skip it between points
+        result = self.rig.run_scan(job, checkpoint=self.queue.checkpoint, output=self.output_message,
+                                   on_point=functools.partial(self.show_point, plot=show_plot))
 
-        # Run the experiment
-        signals = []
-        stds = []
-
-        output_data = np.zeros((len(x_steps), len(y_steps), len(wavelengths)))
-        output_std = np.zeros((len(x_steps), len(y_steps), len(wavelengths)))
-        length = len(x_steps) * len(y_steps) * len(wavelengths)
-        full_data = np.zeros((length, 5))
-
-        # loop through the wavelengths
-        for k in range(len(wavelengths)):
-            # return x to 0
-            if k != 0:
-                time.sleep(2)
-                #self.output_text.insert(tk.END, f"Returning to x = 0\n")
-                self.move_x_auto(-x_steps[-1])
-                time.sleep(2)
-                self.move_y_auto(-y_steps[-1])
-                time.sleep(2)
-
-            # wavelength loop
-            wavelength = wavelengths[k]
-            #self.output_text.insert(tk.END, f"Current wavelength: {wavelength}\n")
-            #self.output_text.see(tk.END)
-            self.auto_wavelength(wavelength)
-            time.sleep(1)
-
-            # loop through the x steps
-            for i in range(len(x_steps)):
-
-                # reset buffers
-                self.reset_buffers()
-
-                x_step = x_steps[i]
-
-                if i != 0:
-                    # return y to 0
-                    time.sleep(3)
-                    #self.output_text.insert(tk.END, f"Returning to y = 0\n")
-                    self.move_y_auto(-y_steps[-1])
-                    time.sleep(4)
-
-                    # reset buffers
-                    self.reset_buffers()
-
-                    # move x to the next step
-                    # self.output_text.insert(tk.END, f"X step: {x_step}\n")
-                    # self.output_text.see(tk.END)
-                    time.sleep(1)
-                    self.move_x_auto(float(self.x_step_size_entry.get()))
-                    time.sleep(1)
-
-                # loop through the y steps
-                for j in range(len(y_steps)):
-                    y_step = y_steps[j]
-                    # self.output_text.insert(tk.END, f"Y step: {y_step}\n")
-                    # self.output_text.see(tk.END)
-                    time.sleep(1)
-                    if j != 0:
-                        # move y to the next step
-                        self.move_y_auto(float(self.y_step_size_entry.get()))
-                        time.sleep(1)
-
-                    # take the measurement
-                    signal, signal_std = self.acquisition()
-                    winsound.Beep(600, 1000)
-                    signals.append(signal)
-                    stds.append(signal_std)
-                    print(wavelength, x_step, y_step, signal, signal_std)
-                    self.output_message(f"{wavelength}, {x_step}, {y_step}, {signal}, {signal_std}")
-                    output_data[i, j, k] = signal
-                    output_std[i, j, k] = signal_std
-
-                    if self.save_data.get():
-                        # save the data to a file
-                        with open(filename, 'a') as f:
-                            f.write(f"{wavelength}, {x_step}, {y_step}, {signal}, {signal_std}\n")
-
-                    # store the data in an array
-                    # TODO: fix ordering of wavelengths in data array - not used currently
-                    full_data[i * len(y_steps) * len(wavelengths) + j * len(wavelengths) + k, 0] = wavelengths[k]
-                    full_data[i * len(y_steps) * len(wavelengths) + j * len(wavelengths) + k, 1] = x_steps[i]
-                    full_data[i * len(y_steps) * len(wavelengths) + j * len(wavelengths) + k, 2] = y_steps[j]
-                    full_data[i * len(y_steps) * len(wavelengths) + j * len(wavelengths) + k, 3] = signal
-                    full_data[i * len(y_steps) * len(wavelengths) + j * len(wavelengths) + k, 4] = signal_std
-                    # self.output_text.insert(tk.END, f"Signal: {signal}\n")
-
-                    # plot the data
-                    plt.plot(wavelength, signal, 'o', color='black')
-                    # plt.errorbar(wavelength, signal, 'o', yerr=signal_std, color='black')
-
-        # return x to 0
-        self.output_text.insert(tk.END, f"Returning to x = 0\n")
-        self.move_x_auto(-x_steps[-1])
-        time.sleep(2)
-        # return y to 0
-        self.output_text.insert(tk.END, f"Returning to y = 0\n")
-        self.move_y_auto(-y_steps[-1])
-        time.sleep(2)
-        # return wavelength to start position
-        self.output_text.insert(tk.END, "Returning wavelength to start position.\n")
-        self.auto_wavelength(float(wavelengths[0]))
-
-        plt.xlabel('Wavelength (nm)')
-        plt.ylabel('Signal (mV)')
-        plt.show()
+        if show_plot:
+            plt.xlabel('Wavelength (nm)')
+            plt.ylabel('Signal (mV)')
+            plt.show()
+        elif result['filename']:
+            # queued scans run unattended, the plot is drawn off screen and saved with the data instead of opening
+            # a plot window from the worker thread
+            self.save_plot(result, result['filename'][:-len(".csv")] + ".png")
 
         # Experiment completed
         winsound.Beep(440, 1000)
         winsound.Beep(440, 2000)
-        self.output_text.insert(tk.END, "Experiment completed.\n\n")
-        self.output_text.see(tk.END)
+        self.output_message("Experiment completed.\n")
+        return True
+
+    def save_plot(self, result, path):
+        # Plot of all the points of a scan saved to a file, without pyplot so that no window is opened
+        points = result['data'].measured()
+        figure = Figure()
+        axes = figure.add_subplot()
+        axes.plot(points['wavelength'], points['signal'], 'o', color='black')
+        axes.set_xlabel('Wavelength (nm)')
+        axes.set_ylabel('Signal (mV)')
+        figure.savefig(path)
+
+    def show_point(self, wavelength, x_step, y_step, values, plot=True):
+        # Called by the scan engine after each point
+        winsound.Beep(600, 1000)
+        print(wavelength, x_step, y_step, *values)
+        if self.server is not None:
+            self.server.send_point(self.queue.current.job_id if self.queue.current else None,
+                                   wavelength, x_step, y_step, values)
+
+        # plot the data
+        if plot:
+            plt.plot(wavelength, values[0], 'o', color='black')
+        # plt.errorbar(wavelength, signal, 'o', yerr=signal_std, color='black')
 
     """
     def run_experiment(self):
@@ -643,26 +587,6 @@ class ExperimentGUI:
         self.output_text.see(tk.END)
         """
 
-    def acquisition(self, rate: int = 10000, length: int = 500):
-        # Take data from the lock-in
-        lockin = SR7230(Socket(address=('169.254.150.230', 50000)))
-        lockin.fast_buffer.enabled = True  # Use fast curve buffer.
-
-        # Set the fast buffer parameters
-        lockin.fast_buffer.storage_interval = rate  # Take data every x us.
-        lockin.fast_buffer.length = length  # Store the max number of points
-        lockin.take_data()  # Start data acquisition immediately.
-
-        # Wait for the data to be taken
-        while lockin.acquisition_status[0] == 'on':
-            time.sleep(0.1)
-
-        # Get the data
-        x = lockin.fast_buffer['x']
-
-        # Return the data
-        return self.convert_signal(np.mean(x)), self.convert_signal(np.std(x))
-
     def browse_root_folder(self):
         self.root_folder = tk.filedialog.askdirectory()
         self.root_folder_entry.delete(0, tk.END)
@@ -682,14 +606,96 @@ class ExperimentGUI:
         self.output_text.insert(tk.END, f"Data saved to {filename}\n")
         self.output_text.see(tk.END)
 
+    def queue_changed(self):
+        # Called by the job queue from any thread
+        self.master.after(0, self.refresh_queue)
+        if self.server is not None:
+            current = self.queue.current
+            self.server.broadcast('queue', current_job=current.job_id if current else None,
+                                  jobs=[(job.job_id, job.status) for job in self.queue.jobs])
+
+    def selected_job(self):
+        # Job selected in the queue list, or None
+        selection = self.queue_listbox.curselection()
+        if not selection or selection[0] >= len(self.queue.jobs):
+            return None
+        return self.queue.jobs[selection[0]]
+
+    def refresh_queue(self):
+        # Show the jobs in the queue list, keeping the selection
+        selection = self.queue_listbox.curselection()
+        self.queue_listbox.delete(0, tk.END)
+        for job in self.queue.jobs:
+            self.queue_listbox.insert(tk.END, job.describe())
+        for index in selection:
+            self.queue_listbox.selection_set(index)
+        self.pause_button.configure(text="Resume" if self.queue.is_paused() else "Pause")
+
+    def add_to_queue(self):
+        job = self.queue.add(self.job_from_entries())
+        self.output_message(f"Added to queue: {job.describe()}")
+
+    def start_queue(self):
+        if not self.queue.pending():
+            self.output_message("There are no queued scans.")
+        elif self.scan_thread is not None and self.scan_thread.is_alive():
+            self.output_message("A scan is already running, start the queue when it has finished.")
+        elif self.queue.start(self.run_queued_job):
+            self.output_message(f"Running {len(self.queue.pending())} queued scans.")
+
+    def pause_queue(self):
+        # Pause or resume the running scan between points
+        if self.queue.is_paused():
+            self.queue.resume()
+            self.output_message("Scan resumed.")
+        else:
+            self.queue.pause()
+            self.output_message("Scan will pause before the next point.")
+
+    def skip_job(self):
+        self.queue.skip()
+        self.output_message("Skipping the running scan.")
+
+    def move_job(self, offset):
+        job = self.selected_job()
+        if job is not None and self.queue.move(job.job_id, offset):
+            index = self.queue.jobs.index(job)
+            self.queue_listbox.selection_clear(0, tk.END)
+            self.queue_listbox.selection_set(index)
+
+    def remove_job(self):
+        job = self.selected_job()
+        if job is not None and not self.queue.remove(job.job_id):
+            self.output_message("The running scan cannot be removed, skip it instead.")
+
     def open_grating_calculator(self):
         calculator_path = "gratingequation.py"
         subprocess.Popen(["python", calculator_path])
 
-    def __init__(self, master):
+    def __init__(self, master, rig=None):
         self.master = master
         master.title("Grating Tester v0.1")
 
+        # HARDWARE
+
+        # Test bench, holds the instrument addresses, calibration constants and the instrument connections,
+        # the settings of the bench (e.g. the stage travel and monochromator range) are loaded from the rig file
+        self.rig = rig or load_bench()
+        self.x_stage = self.rig.x_stage
+        self.y_stage = self.rig.y_stage
+        self.rotation_stages = self.rig.rotation_stages
+        self.monochromator = self.rig.monochromator
+        self.lockin = self.rig.lockin
+
+        # SCANS
+
+        # Only one scan, button press or remote command uses the hardware at a time
+        self.hardware_lock = self.rig.hardware_lock
+        self.scan_thread = None
+        # Queue of scans run one after another on the open connections, saved so that it survives a restart
+        self.server = None
+        self.queue = JobQueue("scan_queue.json", on_change=self.queue_changed)
+
         # CONNECTION FRAME
 
         # Display image on top left of GUI
@@ -817,41 +823,115 @@ class ExperimentGUI:
         self.y_step_number_entry = tk.Entry(experiment_frame, width=10)
         self.y_step_number_entry.grid(row=3, column=2, padx=10, pady=5)
 
+        # Define lock-in settling accuracy, the wait per point is derived from the lock-in time constant and slope
+        self.settle_accuracy_label = tk.Label(experiment_frame, text="Settling accuracy (fraction):")
+        self.settle_accuracy_label.grid(row=4, column=0, padx=10, pady=5)
+        self.default_settle_accuracy = tk.StringVar(value="0.001")
+        self.settle_accuracy_entry = tk.Entry(experiment_frame, width=10, textvariable=self.default_settle_accuracy)
+        self.settle_accuracy_entry.grid(row=4, column=1, padx=10, pady=5)
+        # add a tick box to also watch the lock-in output until it stops changing, default is unchecked
+        self.monitor_settling = tk.IntVar(value=0)
+        self.monitor_settling_checkbutton = tk.Checkbutton(experiment_frame, text="Monitor convergence",
+                                                           variable=self.monitor_settling)
+        self.monitor_settling_checkbutton.grid(row=4, column=2, columnspan=2, padx=10, pady=5)
+
+        # Define monitor detector, read together with the signal so that the ratio removes lamp drift
+        self.monitor_label = tk.Label(experiment_frame, text="Monitor channel:")
+        self.monitor_label.grid(row=5, column=0, padx=10, pady=5)
+        self.monitor_channel = tk.StringVar(value="None")
+        self.monitor_menu = tk.OptionMenu(experiment_frame, self.monitor_channel,
+                                          "None", "Lock-in ADC 2", "Second lock-in")
+        self.monitor_menu.grid(row=5, column=1, padx=10, pady=5)
+        self.default_monitor_address = tk.StringVar(value="169.254.150.231")
+        self.monitor_address_entry = tk.Entry(experiment_frame, width=20, textvariable=self.default_monitor_address)
+        self.monitor_address_entry.grid(row=5, column=2, columnspan=2, padx=10, pady=5)
+
+        # Define grating ID, used to find the runs of a grating in the results catalog
+        self.grating_id_label = tk.Label(experiment_frame, text="Grating ID:")
+        self.grating_id_label.grid(row=6, column=0, padx=10, pady=5)
+        self.grating_id_entry = tk.Entry(experiment_frame, width=20)
+        self.grating_id_entry.grid(row=6, column=1, columnspan=2, padx=10, pady=5)
+        # add a tick box to preset the lock-in sensitivity per wavelength from previous runs of the grating
+        # and auto-range only when the signal is out of range, default is checked
+        self.gain_ranging = tk.IntVar(value=1)
+        self.gain_ranging_checkbutton = tk.Checkbutton(experiment_frame, text="Gain ranging",
+                                                       variable=self.gain_ranging)
+        self.gain_ranging_checkbutton.grid(row=6, column=3, padx=10, pady=5)
+
+        # Define rotation angles of the scan, left empty to scan at the current angles
+        self.job_rotation_label = tk.Label(experiment_frame, text="Rotation [1, 2] (deg):")
+        self.job_rotation_label.grid(row=7, column=0, padx=10, pady=5)
+        self.job_rotation1_entry = tk.Entry(experiment_frame, width=10)
+        self.job_rotation1_entry.grid(row=7, column=1, padx=10, pady=5)
+        self.job_rotation2_entry = tk.Entry(experiment_frame, width=10)
+        self.job_rotation2_entry.grid(row=7, column=2, padx=10, pady=5)
+        # add a tick box to record the instrument I/O of the scan for offline replay, default is unchecked
+        self.record_io = tk.IntVar(value=0)
+        self.record_io_checkbutton = tk.Checkbutton(experiment_frame, text="Record I/O", variable=self.record_io)
+        self.record_io_checkbutton.grid(row=7, column=3, padx=10, pady=5)
+
         # self.output_text = ScrolledText(master, height=8, width=60)
         # self.output_text.grid(row=5, column=0, columnspan=7, padx=10, pady=10)
 
         # Define root folder to save data
         self.root_folder_label = tk.Label(experiment_frame, text="Save data to:")
-        self.root_folder_label.grid(row=7, column=0, padx=10, pady=5)
+        self.root_folder_label.grid(row=8, column=0, padx=10, pady=5)
         self.default_folder = tk.StringVar(value="C:/Users/gooding/Desktop/Automation/Results")
         self.root_folder_entry = tk.Entry(experiment_frame, width=50, textvariable=self.default_folder)
-        self.root_folder_entry.grid(row=7, column=1, columnspan=3, padx=10, pady=5)
+        self.root_folder_entry.grid(row=8, column=1, columnspan=3, padx=10, pady=5)
         self.root_folder_button = tk.Button(experiment_frame, text="Browse", command=self.browse_root_folder)
-        self.root_folder_button.grid(row=7, column=4, padx=10, pady=10)
+        self.root_folder_button.grid(row=8, column=4, padx=10, pady=10)
 
         # Define file name
         self.file_name_label = tk.Label(experiment_frame, text="File name:")
-        self.file_name_label.grid(row=8, column=0, padx=10, pady=5)
+        self.file_name_label.grid(row=9, column=0, padx=10, pady=5)
         self.file_name_entry = tk.Entry(experiment_frame, width=50)
-        self.file_name_entry.grid(row=8, column=1, columnspan=3, padx=10, pady=5)
+        self.file_name_entry.grid(row=9, column=1, columnspan=3, padx=10, pady=5)
 
         # add a tick box to save data, default is checked
         self.save_data = tk.IntVar(value=1)
         self.save_data_checkbutton = tk.Checkbutton(experiment_frame, text="Save data", variable=self.save_data)
-        self.save_data_checkbutton.grid(row=8, column=4, padx=10, pady=10)
+        self.save_data_checkbutton.grid(row=9, column=4, padx=10, pady=10)
 
         # Buttons
         self.run_button = tk.Button(experiment_frame, text="Run", command=self.threading)
         #command=self.run_experiment)
-        self.run_button.grid(row=9, column=3, padx=10, pady=10)
+        self.run_button.grid(row=10, column=3, padx=10, pady=10)
+        # check the scan settings and estimate the run time before pressing Run
+        self.check_button = tk.Button(experiment_frame, text="Check", command=self.check_plan)
+        self.check_button.grid(row=10, column=2, padx=10, pady=10)
+        self.estimate_label = tk.Label(experiment_frame, text="Press Check to estimate the run time")
+        self.estimate_label.grid(row=11, column=0, columnspan=5, padx=10, pady=5)
         self.quit_button = tk.Button(experiment_frame, text="Quit", command=master.quit)
-        self.quit_button.grid(row=9, column=4, padx=10, pady=10)
+        self.quit_button.grid(row=10, column=4, padx=10, pady=10)
         # add a help button to open pdf manual
         self.help_button = tk.Button(experiment_frame, text="Help", command=self.open_help)
-        self.help_button.grid(row=9, column=0, padx=10, pady=10)
+        self.help_button.grid(row=10, column=0, padx=10, pady=10)
         self.open_calculator_button = tk.Button(root, text="Grating Calculator", command=self.open_grating_calculator)
         self.open_calculator_button.grid(row=9, column=1, padx=10, pady=10)
 
+        # QUEUE FRAME
+
+        self.queue_listbox = tk.Listbox(queue_frame, height=20, width=60, exportselection=False)
+        self.queue_listbox.grid(row=1, column=0, columnspan=4, padx=10, pady=5)
+        self.add_job_button = tk.Button(queue_frame, text="Add to queue", command=self.add_to_queue)
+        self.add_job_button.grid(row=2, column=0, padx=5, pady=5)
+        self.start_queue_button = tk.Button(queue_frame, text="Start", command=self.start_queue)
+        self.start_queue_button.grid(row=2, column=1, padx=5, pady=5)
+        self.pause_button = tk.Button(queue_frame, text="Pause", command=self.pause_queue)
+        self.pause_button.grid(row=2, column=2, padx=5, pady=5)
+        self.skip_button = tk.Button(queue_frame, text="Skip", command=self.skip_job)
+        self.skip_button.grid(row=2, column=3, padx=5, pady=5)
+        self.move_up_button = tk.Button(queue_frame, text="Up", command=lambda: self.move_job(-1))
+        self.move_up_button.grid(row=3, column=0, padx=5, pady=5)
+        self.move_down_button = tk.Button(queue_frame, text="Down", command=lambda: self.move_job(1))
+        self.move_down_button.grid(row=3, column=1, padx=5, pady=5)
+        self.remove_job_button = tk.Button(queue_frame, text="Remove", command=self.remove_job)
+        self.remove_job_button.grid(row=3, column=2, padx=5, pady=5)
+        self.clear_jobs_button = tk.Button(queue_frame, text="Clear finished", command=self.queue.clear_finished)
+        self.clear_jobs_button.grid(row=3, column=3, padx=5, pady=5)
+        self.refresh_queue()
+
         # OUTPUT TEXT FRAME
 
         self.output_text = ScrolledText(master, height=10, width=80)
@@ -861,6 +941,29 @@ class ExperimentGUI:
         self.output_message("v0.1.0")
         self.output_message("Author: David Gooding")
         self.output_message("Date: 2023-05-16")
+        if rig is None:
+            if os.path.exists(RIG_FILE):
+                self.output_message(f"Rig settings loaded from {RIG_FILE}")
+            else:
+                self.output_message(f"No {RIG_FILE} found, using the default rig settings.")
+        for message in self.rig.unchecked_limits():
+            self.output_message(message)
+        if self.rig.switch_wavelengths:
+            self.output_message(f"Monochromator switch-over wavelengths: {list(self.rig.switch_wavelengths)} nm")
+        else:
+            self.output_message("No monochromator switch-over table configured, wavelengths are measured in the "
+                                "order of the scan.")
+
+        # REMOTE CONTROL
+
+        # Local control server so that scripts can drive the instruments and submit scans while the GUI is open
+        self.server = ControlServer(self.rig, self.queue, start_queue=self.start_queue)
+        try:
+            host, port = self.server.start()
+            self.output_message(f"Remote control on {host}:{port}")
+        except OSError as error:
+            self.server = None
+            self.output_message(f"Remote control not available: {error}")
 
 
 # Create the main window
@@ -882,6 +985,11 @@ experiment_frame = tk.Frame(root, width=200, height=400)
 experiment_frame.grid(row=1, column=1, padx=10, pady=5)
 tk.Label(experiment_frame, text="Experiment settings", font='Helvetica 12 bold', justify="left", anchor="w").grid(row=0, column=0, padx=5, pady=5)
 
+# Create queue frame
+queue_frame = tk.Frame(root, width=200, height=400)
+queue_frame.grid(row=0, column=2, rowspan=2, padx=10, pady=5)
+tk.Label(queue_frame, text="Scan queue", font='Helvetica 12 bold', justify="left", anchor="w").grid(row=0, column=0, padx=5, pady=5)
+
 # Create an instance of the experiment GUI
 experiment = ExperimentGUI(root)
 
@@ -0,0 +1,396 @@
+"""
+Project: Grating Tester
+File: iorecord.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Record and replay of the instrument I/O of a rig.
+
+While it is attached to a rig, the recorder wraps the device factories of the rig (the serial ports of the stages,
+the bendev monochromator, the SR7230 lock-ins and the thorlabs_apt module), so every command sent to an instrument and
+every reply is written to a json lines file with its start time and duration, along with every wait of the scan
+engine. Nothing else changes, so a recording can be taken during a real run on the real rig.
+
+The replay backend builds the same rig with device factories that answer from the recording, so the real drivers and
+scan engine run offline against the actual instrument behaviour. The commands of each instrument must come in the
+recorded order (strict), or recorded commands that the engine no longer sends can be skipped (strict=False, e.g. to
+check an engine change that removes redundant moves). Time runs on a virtual clock taken from the recorded start times
+and durations of the instrument I/O and waits that the replay goes through: the clock advances by the recorded time
+each of them adds to the time already covered, so I/O that overlapped in the real run (e.g. the sensitivity preset
+during a monochromator move, or two lock-ins read in parallel) overlaps in the replay too, and waits that were not
+recorded are added as they are. The replay is deterministic. With speed=None nothing is actually slept, otherwise the
+replay runs speed times faster than the real run. The replay report gives the modelled duration of the run on the real
+rig, and the instrument I/O and wait times it is made of.
+
+A scan job with record_io set is recorded to '<timestamp>_<file name>.io.jsonl' in its results folder.
+
+Usage:
+    recorder = Recorder("run.io.jsonl", rig)
+    rig.run_scan(job)
+    recorder.close()
+
+    rig, replay = replay_rig("run.io.jsonl", speed=None)
+    rig.run_scan(replay.job("C:/Temp/replay"))
+    print(replay.report())
+
+"""
+import json
+import time
+from threading import Lock
+import numpy as np
+
+from rig import Rig
+from jobqueue import ScanJob
+
+PRIMITIVES = (type(None), bool, int, float, str)
+
+
+class ReplayMismatch(Exception):
+    # Raised when the engine sends a command that is not in the recording
+    pass
+
+
+def encodable(value):
+    # True if a value is data (recorded as it is) rather than an instrument object (recorded through a proxy)
+    if isinstance(value, PRIMITIVES + (bytes, np.ndarray, np.generic)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(encodable(item) for item in value)
+    return False
+
+
+def encode(value):
+    if isinstance(value, bytes):
+        return {'bytes': value.decode('latin-1')}
+    if isinstance(value, (np.ndarray, tuple, list)):
+        return [encode(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict) and 'bytes' in value:
+        return value['bytes'].encode('latin-1')
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+class RecordingProxy:
+    # Passes attribute reads, writes and calls through to an instrument object and records them
+    def __init__(self, target, recorder, device):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_recorder', recorder)
+        object.__setattr__(self, '_device', device)
+
+    def _run(self, op, name, args, action):
+        start = time.time()
+        try:
+            result = action()
+        except Exception as error:
+            self._recorder.log(self._device, op, name, args, start, error=f"{type(error).__name__}: {error}")
+            raise
+        if encodable(result):
+            self._recorder.log(self._device, op, name, args, start, result=encode(result))
+            return result
+        # instrument objects returned (e.g. the fast buffer or an APT Motor) are recorded as devices of their own
+        device = f"{self._device}/{name}" + (f"({','.join(str(arg) for arg in args)})" if op == 'call' else "")
+        self._recorder.log(self._device, op, name, args, start, result={'object': device})
+        return RecordingProxy(result, self._recorder, device)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            def call(*args):
+                return self._run('call', name, [encode(arg) for arg in args], lambda: value(*args))
+            return call
+        return self._run('get', name, [], lambda: value)
+
+    def __setattr__(self, name, value):
+        self._run('set', name, [encode(value)], lambda: setattr(self._target, name, value))
+
+    def __getitem__(self, key):
+        return self._run('getitem', '[]', [encode(key)], lambda: self._target[key])
+
+
+class LazyModule:
+    # Module loaded on first use, e.g. thorlabs_apt which loads the APT library when it is imported
+    def __init__(self, load):
+        self.load = load
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+class Recorder:
+    def __init__(self, path, rig, job=None):
+        # Record the instrument I/O of a rig until close(), the connections of the rig are reopened through the
+        # recorder so that the recording starts from a known state
+        self.path = path
+        self.rig = rig
+        self.lock = Lock()
+        self.start = time.time()
+        self.file = open(path, 'w')     # None once the recording is closed
+        self.write({'op': 'start', 'time': self.start})
+        self.write({'op': 'rig', 'config': rig.to_config()})
+        if job is not None:
+            self.write({'op': 'job', 'settings': job.settings})
+        self.originals = self.attach(rig)
+
+    def write(self, event):
+        # events are written as they happen, so the recording survives a crash
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps(event) + "\n")
+            self.file.flush()
+
+    def log(self, device, op, name, args, start, result=None, error=None):
+        event = {'t': round(start - self.start, 6), 'dt': round(time.time() - start, 6), 'device': device,
+                 'op': op, 'name': name, 'args': args}
+        if error is not None:
+            event['error'] = error
+        else:
+            event['result'] = result
+        self.write(event)
+
+    def open(self, device, factory, *args, **kwargs):
+        start = time.time()
+        target = factory(*args, **kwargs)
+        self.log(device, 'open', device, [], start)
+        return RecordingProxy(target, self, device)
+
+    def attach(self, rig):
+        # Route the device factories and waits of the rig through the recorder, returns the original ones
+        originals = {'x_port': rig.x_stage.open_port, 'y_port': rig.y_stage.open_port,
+                     'monochromator': rig.monochromator.open_device, 'lockin': rig.lockin.open_device,
+                     'monitor_lockin': rig.open_lockin, 'apt': rig.rotation_stages.apt, 'sleeper': rig.sleeper}
+        open_lockin = rig.lockin.open_device
+        sleeper = rig.sleeper
+        rig.x_stage.open_port = lambda port, **options: self.open(f"serial:{port}", originals['x_port'], port,
+                                                                  **options)
+        rig.y_stage.open_port = lambda port, **options: self.open(f"serial:{port}", originals['y_port'], port,
+                                                                  **options)
+        rig.monochromator.open_device = lambda: self.open("bendev", originals['monochromator'])
+        rig.lockin.open_device = rig.open_lockin = \
+            lambda address: self.open("sr7230:%s:%s" % tuple(address), open_lockin, address)
+
+        def load_apt():
+            if originals['apt'] is not None:
+                return originals['apt']
+            import thorlabs_apt as apt  # Thorlabs stages
+            return apt
+        rig.rotation_stages.apt = LazyModule(lambda: RecordingProxy(load_apt(), self, 'apt'))
+
+        def sleep(seconds):
+            self.write({'t': round(time.time() - self.start, 6), 'dt': seconds, 'device': 'rig', 'op': 'sleep'})
+            sleeper(seconds)
+        rig.sleeper = sleep
+        self.disconnect(rig)
+        return originals
+
+    def disconnect(self, rig):
+        rig.x_stage.close()
+        rig.y_stage.close()
+        rig.monochromator.disconnect()
+        rig.lockin.disconnect()
+        rig.monitor_lockin = None
+        rig.rotation_stages.serials = []
+        rig.rotation_stages.motors = {}
+
+    def close(self):
+        # Stop recording, the rig goes back to its own device factories
+        rig, originals = self.rig, self.originals
+        rig.x_stage.open_port = originals['x_port']
+        rig.y_stage.open_port = originals['y_port']
+        rig.monochromator.open_device = originals['monochromator']
+        rig.lockin.open_device = originals['lockin']
+        rig.open_lockin = originals['monitor_lockin']
+        rig.rotation_stages.apt = originals['apt']
+        rig.sleeper = originals['sleeper']
+        with self.lock:
+            self.file.close()
+            self.file = None
+        # the connections opened through the recorder are closed after the recording ends, so that the replay,
+        # which leaves its connections open, has no commands left over
+        self.disconnect(rig)
+
+
+class ReplayProxy:
+    # Answers attribute reads, writes and calls from the recorded events of one device
+    def __init__(self, replay, device):
+        object.__setattr__(self, '_replay', replay)
+        object.__setattr__(self, '_device', device)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        event = self._replay.peek(self._device, name)
+        if event['op'] == 'call':
+            def call(*args):
+                return self._replay.answer(self._device, 'call', name, [encode(arg) for arg in args])
+            return call
+        return self._replay.answer(self._device, 'get', name, [])
+
+    def __setattr__(self, name, value):
+        self._replay.answer(self._device, 'set', name, [encode(value)])
+
+    def __getitem__(self, key):
+        return self._replay.answer(self._device, 'getitem', '[]', [encode(key)])
+
+
+class Replay:
+    def __init__(self, path, speed=None, strict=True):
+        # speed is how many times faster than the real run the replay runs, None does not sleep at all
+        self.speed = speed
+        self.strict = strict
+        self.lock = Lock()
+        self.config = {}
+        self.settings = None    # settings of the recorded scan job
+        self.events = {}    # device -> recorded events in order
+        self.cursors = {}   # device -> index of the next event
+        self.sleeps = []    # recorded waits (t, dt) in order
+        self.recorded_sleep = 0.0
+        self.recorded_duration = 0.0
+        with open(path) as f:
+            for line in f:
+                event = json.loads(line)
+                if event['op'] == 'rig':
+                    self.config = event['config']
+                elif event['op'] == 'job':
+                    self.settings = event['settings']
+                elif event['op'] == 'sleep':
+                    self.sleeps.append((event['t'], event['dt']))
+                    self.recorded_sleep += event['dt']
+                elif event['op'] != 'start':
+                    self.events.setdefault(event['device'], []).append(event)
+                if 't' in event:
+                    self.recorded_duration = max(self.recorded_duration, event['t'] + event['dt'])
+        self.cursors = {device: 0 for device in self.events}
+        self.sleep_taken = [False] * len(self.sleeps)
+        self.sleep_cursor = 0   # index of the first recorded wait not replayed
+        self.covered = []   # recorded (start, end) intervals replayed so far, merged and in order
+        self.virtual_time = 0.0
+        self.sleep_time = 0.0
+        self.io_time = 0.0
+        self.answered = 0
+        self.skipped = 0
+
+    def clock(self):
+        return self.virtual_time
+
+    def advance(self, seconds):
+        with self.lock:
+            self.virtual_time += seconds
+        if self.speed:
+            time.sleep(seconds / self.speed)
+
+    def cover(self, start, duration):
+        # Add a recorded interval to the time covered by the replay, returns the time (s) it adds to it
+        end = start + duration
+        with self.lock:
+            covered = self.covered
+            # intervals from index on end after this one starts, those from index to last overlap it
+            index = len(covered)
+            while index > 0 and covered[index - 1][1] >= start:
+                index -= 1
+            last = index
+            added = end - start
+            merged = (start, end)
+            while last < len(covered) and covered[last][0] <= end:
+                low, high = covered[last]
+                added -= max(0.0, min(high, end) - max(low, start))
+                merged = (min(merged[0], low), max(merged[1], high))
+                last += 1
+            covered[index:last] = [merged]
+        return added
+
+    def sleep(self, seconds):
+        # A wait of the engine takes its place in the recorded timeline if the recording has a wait of the same length
+        # that has not been replayed, otherwise it is added to the clock as it is
+        self.sleep_time += seconds
+        with self.lock:
+            index = next((index for index in range(self.sleep_cursor, len(self.sleeps))
+                          if not self.sleep_taken[index] and abs(self.sleeps[index][1] - seconds) < 1e-9), None)
+            if index is not None:
+                self.sleep_taken[index] = True
+                while self.sleep_cursor < len(self.sleeps) and self.sleep_taken[self.sleep_cursor]:
+                    self.sleep_cursor += 1
+        if index is None:
+            self.advance(seconds)
+        else:
+            self.advance(self.cover(*self.sleeps[index]))
+
+    def find(self, device, match):
+        # Index of the next event of a device that matches, only the next event is considered when strict
+        events = self.events.get(device, [])
+        cursor = self.cursors.get(device, 0)
+        last = len(events) if not self.strict else min(cursor + 1, len(events))
+        for index in range(cursor, last):
+            if match(events[index]):
+                return index
+        if cursor < len(events):
+            expected = events[cursor]
+            raise ReplayMismatch(f"{device}: expected {expected['op']} {expected['name']} {expected['args']}")
+        raise ReplayMismatch(f"{device}: no more recorded events")
+
+    def peek(self, device, name):
+        with self.lock:
+            return self.events[device][self.find(device, lambda event: event['name'] == name)]
+
+    def take(self, device, op, name, args):
+        with self.lock:
+            index = self.find(device, lambda event: (event['op'], event['name'], event['args']) == (op, name, args))
+            if index != self.cursors[device]:
+                self.skipped += index - self.cursors[device]
+            self.cursors[device] = index + 1
+            self.answered += 1
+            return self.events[device][index]
+
+    def answer(self, device, op, name, args):
+        try:
+            event = self.take(device, op, name, args)
+        except ReplayMismatch as error:
+            raise ReplayMismatch(f"{error}, got {op} {name} {args}") from None
+        self.io_time += event['dt']
+        self.advance(self.cover(event['t'], event['dt']))
+        if 'error' in event:
+            raise IOError(f"Replayed error: {event['error']}")
+        result = event['result']
+        if isinstance(result, dict) and 'object' in result:
+            return ReplayProxy(self, result['object'])
+        return decode(result)
+
+    def open(self, device):
+        self.answer(device, 'open', device, [])
+        return ReplayProxy(self, device)
+
+    def job(self, root_folder, **settings):
+        # The recorded scan job, saving to another folder so that the results of the real run are left alone
+        return ScanJob(dict(self.settings or {}, root_folder=root_folder, record_io=0, **settings))
+
+    def factories(self):
+        # Device factories of the rig that answer from the recording
+        return {'open_port': lambda port, **options: self.open(f"serial:{port}"),
+                'open_monochromator': lambda: self.open("bendev"),
+                'open_lockin': lambda address: self.open("sr7230:%s:%s" % tuple(address)),
+                'apt': ReplayProxy(self, 'apt')}
+
+    def remaining(self):
+        # Number of recorded events not replayed, per device
+        return {device: len(events) - self.cursors[device] for device, events in self.events.items()
+                if len(events) > self.cursors[device]}
+
+    def report(self):
+        return {'recorded_duration': self.recorded_duration, 'recorded_sleep': self.recorded_sleep,
+                'replayed_duration': self.virtual_time, 'sleep_time': self.sleep_time, 'io_time': self.io_time,
+                'answered': self.answered, 'skipped': self.skipped, 'remaining': self.remaining()}
+
+
+def replay_rig(path, speed=None, strict=True):
+    # Rig as recorded in a recording, answering from it. Returns (rig, replay)
+    replay = Replay(path, speed, strict)
+    rig = Rig(**replay.config, **replay.factories(), sleep=replay.sleep, clock=replay.clock)
+    return rig, replay
@@ -0,0 +1,210 @@
+"""
+Project: Grating Tester
+File: jobqueue.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Queue of scan jobs for unattended multi-grating campaigns.
+
+A scan job holds the settings of one scan (grating, wavelength band, X and Y steps, rotation angles, where to save
+the data). Jobs are run one after another in a worker thread on the instrument connections that are already open,
+and the queue is saved to a json file after every change so that it survives a restart. The queue can be paused,
+the running job skipped and the waiting jobs reordered or removed while it runs.
+
+Usage:
+    queue = JobQueue("scan_queue.json")
+    queue.add(ScanJob({'grating_id': "VPHG-01", 'wavelength_start': "800", ...}))
+    queue.start(run_job)    # run_job(job) runs one scan and calls queue.checkpoint() between points
+
+"""
+import json
+import os
+import time
+import uuid
+from threading import Thread, Event, RLock
+
+# settings of a scan job, with the defaults used when a setting is not given
+JOB_SETTINGS = {'name': "", 'grating_id': "",
+                'wavelength_start': "", 'wavelength_stop': "", 'wavelength_step': "",
+                'x_step_size': "", 'x_step_number': "", 'y_step_size': "", 'y_step_number': "",
+                'rotation1': "", 'rotation2': "",
+                'root_folder': "", 'file_name': "", 'save_data': 1,
+                'settle_accuracy': "0.001", 'monitor_settling': 0,
+                'monitor_channel': "None", 'monitor_address': "169.254.150.231", 'gain_ranging': 1,
+                'record_io': 0}
+
+
+class JobSkipped(Exception):
+    # Raised at a checkpoint in a scan when the running job has been skipped
+    pass
+
+
+class ScanJob:
+    def __init__(self, settings, job_id=None, status='queued', message=""):
+        self.settings = dict(JOB_SETTINGS)
+        self.settings.update(settings)
+        self.job_id = job_id or uuid.uuid4().hex[:8]
+        self.status = status    # 'queued', 'running', 'done', 'skipped' or 'failed'
+        self.message = message
+        self.started = None
+        self.finished = None
+
+    def __getitem__(self, name):
+        return self.settings[name]
+
+    def describe(self):
+        settings = self.settings
+        name = settings['name'] or settings['file_name'] or self.job_id
+        return (f"[{self.status}] {name} {settings['grating_id']} "
+                f"{settings['wavelength_start']}-{settings['wavelength_stop']} nm")
+
+    def to_dict(self):
+        return {'job_id': self.job_id, 'status': self.status, 'message': self.message,
+                'started': self.started, 'finished': self.finished, 'settings': self.settings}
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['settings'], data['job_id'], data['status'], data.get('message', ""))
+        job.started = data.get('started')
+        job.finished = data.get('finished')
+        return job
+
+
+class JobQueue:
+    def __init__(self, path=None, on_change=None):
+        # path of the json file the queue is saved to, on_change is called (in any thread) when the queue changes
+        self.path = path
+        self.on_change = on_change
+        self.jobs = []
+        self.lock = RLock()
+        self.resume_event = Event()     # cleared while the queue is paused
+        self.resume_event.set()
+        self.skip_event = Event()   # set to skip the running job
+        self.worker = None
+        self.current = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.jobs = [ScanJob.from_dict(data) for data in json.load(f)]
+            # a job that was running when the program stopped is run again
+            for job in self.jobs:
+                if job.status == 'running':
+                    job.status = 'queued'
+
+    def save(self):
+        with self.lock:
+            if self.path:
+                with open(self.path, 'w') as f:
+                    json.dump([job.to_dict() for job in self.jobs], f, indent=1)
+        if self.on_change:
+            self.on_change()
+
+    def add(self, job):
+        with self.lock:
+            self.jobs.append(job)
+        self.save()
+        return job
+
+    def find(self, job_id):
+        with self.lock:
+            for job in self.jobs:
+                if job.job_id == job_id:
+                    return job
+        return None
+
+    def remove(self, job_id):
+        # Remove a job that is not running
+        with self.lock:
+            job = self.find(job_id)
+            if job is None or job is self.current:
+                return False
+            self.jobs.remove(job)
+        self.save()
+        return True
+
+    def move(self, job_id, offset):
+        # Move a job up (offset < 0) or down (offset > 0) the queue
+        with self.lock:
+            job = self.find(job_id)
+            if job is None:
+                return False
+            index = self.jobs.index(job)
+            new_index = min(max(index + offset, 0), len(self.jobs) - 1)
+            self.jobs.insert(new_index, self.jobs.pop(index))
+        self.save()
+        return True
+
+    def clear_finished(self):
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job.status in ('queued', 'running')]
+        self.save()
+
+    def pending(self):
+        with self.lock:
+            return [job for job in self.jobs if job.status == 'queued']
+
+    def is_running(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def is_paused(self):
+        return not self.resume_event.is_set()
+
+    def pause(self):
+        self.resume_event.clear()
+        if self.on_change:
+            self.on_change()
+
+    def resume(self):
+        self.resume_event.set()
+        if self.on_change:
+            self.on_change()
+
+    def skip(self):
+        # Skip the running job at its next checkpoint
+        self.skip_event.set()
+        self.resume_event.set()
+
+    def clear_skip(self):
+        # Forget a skip requested while no job was running, so that it does not stop the next scan
+        self.skip_event.clear()
+
+    def checkpoint(self):
+        # Called by a scan between points, waits while the queue is paused and raises JobSkipped if skipped
+        self.resume_event.wait()
+        if self.skip_event.is_set():
+            self.skip_event.clear()
+            raise JobSkipped()
+
+    def start(self, run_job):
+        # Run the queued jobs one after another in a worker thread, run_job(job) runs one scan
+        if self.is_running():
+            return False
+        self.worker = Thread(target=self.work, args=(run_job,), daemon=True)
+        self.worker.start()
+        return True
+
+    def work(self, run_job):
+        while True:
+            self.resume_event.wait()
+            with self.lock:
+                pending = self.pending()
+                if not pending:
+                    break
+                job = self.current = pending[0]
+                job.status = 'running'
+                job.started = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.clear_skip()
+            self.save()
+            try:
+                run_job(job)
+                job.status = 'done'
+            except JobSkipped:
+                job.status = 'skipped'
+            except Exception as error:
+                # a failed job does not stop the rest of the queue
+                job.status = 'failed'
+                job.message = str(error)
+            job.finished = time.strftime("%Y-%m-%d %H:%M:%S")
+            with self.lock:
+                self.current = None
+            self.save()
@@ -0,0 +1,286 @@
+"""
+Project: Grating Tester
+File: lockincontrol.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Driver layer for the Signal Recovery 7230 lock-in amplifier.
+
+The connection to the lock-in is opened once and kept. The instrument settings (e.g. the fast buffer configuration)
+are mirrored locally, so that only settings which have changed are sent. Settings are written together at the start
+of a run and checked against the instrument once per run, rather than being set over the network before every point.
+
+The time constant and filter slope are read once per run and used to work out how long the output takes to settle
+after a move or a wavelength change, so each point waits only as long as the lock-in filter needs.
+
+A monitor detector can be read at the same time as the signal, either from the second ADC input of the same lock-in
+(stored in the same fast buffer, so the samples are simultaneous) or from a second lock-in read in parallel. The
+signal/monitor ratio and its uncertainty remove the lamp drift from the measurement.
+
+The sensitivity can be preset from a gain map (see gainmap.py) and is only auto-ranged when a block of data shows an
+overload or under-range. Readings are scaled to the sensitivity at the start of the run so they stay comparable.
+
+Dependencies:
+- slave: communication with the SR7230 over ethernet (imported on first connection, so simulated lock-ins run without it)
+
+"""
+import math
+import re
+import time
+from threading import Thread
+import numpy as np
+
+# fast buffer values are scaled so that +-10000 is the full scale of the sensitivity
+FULL_SCALE = 10000
+# fractions of full scale treated as an overload (peak) and as under-range (mean)
+OVERLOAD_LEVEL = 0.95
+UNDER_RANGE_LEVEL = 0.05
+
+
+def slope_db(slope):
+    # Filter slope in dB/octave from the slope setting, e.g. '12dB', '24 dB' or 24
+    match = re.match(r'\s*(\d+(?:\.\d*)?)', str(slope))
+    if match is None:
+        raise ValueError(f"Unknown lock-in filter slope: {slope!r}")
+    return float(match.group(1))
+
+
+def settling_factor(slope, accuracy=1e-3):
+    # Number of time constants for the output to settle within accuracy of a step change in the input.
+    # Each 6 dB/octave of slope is one RC stage, the step response of n stages is 1 - exp(-t) * sum(t^k / k!, k < n)
+    order = max(1, int(round(slope_db(slope) / 6)))
+
+    def remaining(t):
+        return math.exp(-t) * sum(t ** k / math.factorial(k) for k in range(order))
+
+    low, high = 0.0, 1.0
+    while remaining(high) > accuracy:
+        high *= 2
+    while high - low > 1e-3:
+        middle = (low + high) / 2
+        if remaining(middle) > accuracy:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def open_sr7230(address):
+    from slave.transport import Socket
+    from slave.signal_recovery import SR7230    # Lock-in amplifier
+    return SR7230(Socket(address=address))
+
+
+def ratio_statistics(signal, monitor):
+    # Ratio of the means of simultaneous signal and monitor samples and its standard deviation, propagated from the
+    # sample standard deviations and the covariance so that noise common to both channels (lamp drift) cancels
+    signal = np.asarray(signal, dtype=float)
+    monitor = np.asarray(monitor, dtype=float)
+    n = min(len(signal), len(monitor))
+    signal, monitor = signal[:n], monitor[:n]
+    s, m = np.mean(signal), np.mean(monitor)
+    ratio = s / m
+    covariance = np.cov(signal, monitor, ddof=0)
+    relative_variance = (covariance[0, 0] / s ** 2 + covariance[1, 1] / m ** 2
+                         - 2 * covariance[0, 1] / (s * m))
+    return ratio, abs(ratio) * np.sqrt(max(relative_variance, 0.0))
+
+
+def acquire_pair(signal_lockin, monitor_lockin, rate=10000, length=500, monitor_curve='x', autorange=False):
+    # Take the signal and monitor samples together. If the monitor is on the same lock-in (e.g. monitor_curve='adc2')
+    # both curves come from the same fast buffer, otherwise the two lock-ins are read in parallel
+    if monitor_lockin is None or monitor_lockin is signal_lockin:
+        return signal_lockin.acquire_ranged(rate, length, ('x', monitor_curve), autorange)
+    results = {}
+    errors = []
+
+    def read(name, acquire, *args):
+        try:
+            results[name] = acquire(*args)[0]
+        except Exception as error:
+            errors.append(error)
+
+    threads = [Thread(target=read, args=('signal', signal_lockin.acquire_ranged, rate, length, ('x',), autorange)),
+               Thread(target=read, args=('monitor', monitor_lockin.acquire_curves, rate, length, (monitor_curve,)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results['signal'], results['monitor']
+
+
+class LockIn:
+    def __init__(self, address=('169.254.150.230', 50000), open_device=None, sleep=time.sleep, clock=time.time):
+        self.address = address
+        # open_device(address) opens the connection, sleep(seconds) waits and clock() gives the time, they are
+        # replaced to run against a simulated or replayed lock-in
+        self.open_device = open_device or open_sr7230
+        self.sleep = sleep
+        self.clock = clock
+        self.device = None
+        self.settings = {}  # mirrored instrument settings, e.g. {'fast_buffer.length': 500}
+        self.time_constant = None   # output filter time constant (s), read once per run
+        self.slope = None   # output filter slope (dB/octave), read once per run
+        self.reference_sensitivity = None   # sensitivity at the start of the run, readings are scaled to it
+        self.range_status = None    # 'overload' or 'under-range' if the last point needed auto-ranging
+
+    def connect(self):
+        if self.device is None:
+            self.device = self.open_device(self.address)
+            self.settings = {}
+        return self.device
+
+    def disconnect(self):
+        self.device = None
+        self.settings = {}
+
+    def invalidate(self):
+        # Forget the mirrored settings so that they are all sent again
+        self.settings = {}
+
+    def read(self, path):
+        # Read a setting from the instrument, e.g. read('fast_buffer.length')
+        obj = self.connect()
+        for name in path.split('.'):
+            obj = getattr(obj, name)
+        return obj
+
+    def write(self, path, value):
+        # Write a setting to the instrument and mirror it locally
+        names = path.split('.')
+        obj = self.connect()
+        for name in names[:-1]:
+            obj = getattr(obj, name)
+        setattr(obj, names[-1], value)
+        self.settings[path] = value
+
+    def configure(self, settings):
+        # Send the settings which differ from the mirrored state, returns the settings that were sent
+        changed = {path: value for path, value in settings.items()
+                   if path not in self.settings or self.settings[path] != value}
+        try:
+            for path, value in changed.items():
+                self.write(path, value)
+        except Exception:
+            # the instrument state is unknown after a failed write
+            self.disconnect()
+            raise
+        return changed
+
+    def verify(self):
+        # Check the mirrored settings against the instrument, resending any that differ
+        corrected = {}
+        for path, value in list(self.settings.items()):
+            if self.read(path) != value:
+                self.write(path, value)
+                corrected[path] = value
+        return corrected
+
+    def prepare_run(self, rate=10000, length=500):
+        # Configure the fast buffer once for a run, verify the instrument state and read the filter settings
+        self.configure({'fast_buffer.enabled': True,    # Use fast curve buffer.
+                        'fast_buffer.storage_interval': rate,   # Take data every x us.
+                        'fast_buffer.length': length})  # Store the max number of points
+        corrected = self.verify()
+        self.time_constant = float(self.read('time_constant'))
+        self.slope = self.read('slope')
+        self.settings['sensitivity'] = self.read('sensitivity')
+        self.reference_sensitivity = self.settings['sensitivity']
+        return corrected
+
+    def end_run(self):
+        # Stop scaling readings to the start of the run, readings taken outside a run are not scaled
+        self.reference_sensitivity = None
+
+    def set_sensitivity(self, sensitivity):
+        # Preset the sensitivity, only sent if it has changed
+        return self.configure({'sensitivity': sensitivity})
+
+    def read_sensitivity(self):
+        # Read the sensitivity back from the instrument, e.g. when a failed write has left it unknown
+        self.settings['sensitivity'] = self.read('sensitivity')
+        return self.settings['sensitivity']
+
+    def auto_sensitivity(self):
+        # Let the lock-in choose the sensitivity, returns the new sensitivity
+        self.connect().auto_sensitivity()
+        return self.read_sensitivity()
+
+    def sensitivity_scale(self):
+        # Factor that scales readings at the current sensitivity to the sensitivity at the start of the run,
+        # readings taken outside a run are not scaled
+        if self.reference_sensitivity is None:
+            return 1.0
+        if 'sensitivity' not in self.settings:
+            raise RuntimeError("Lock-in sensitivity is unknown, readings cannot be scaled to the start of the run")
+        return float(self.settings['sensitivity']) / float(self.reference_sensitivity)
+
+    def check_range(self, samples):
+        # 'overload' or 'under-range' if a block of fast buffer data is out of range, otherwise None
+        samples = np.abs(np.asarray(samples, dtype=float))
+        if np.max(samples) >= OVERLOAD_LEVEL * FULL_SCALE:
+            return 'overload'
+        if np.mean(samples) < UNDER_RANGE_LEVEL * FULL_SCALE:
+            return 'under-range'
+        return None
+
+    def settle_time(self, accuracy=1e-3):
+        # Minimum time (s) for the output to settle within accuracy after a step change
+        if self.time_constant is None:
+            self.time_constant = float(self.read('time_constant'))
+            self.slope = self.read('slope')
+        return settling_factor(self.slope, accuracy) * self.time_constant
+
+    def wait_settled(self, accuracy=1e-3, monitor=False, timeout=None):
+        # Wait for the output to settle, optionally watching the output until it stops changing.
+        # Returns the time waited (s)
+        start = self.clock()
+        wait = self.settle_time(accuracy)
+        self.sleep(wait)
+        if monitor:
+            if timeout is None:
+                timeout = 5 * wait
+            previous = float(self.read('x'))
+            while self.clock() - start < wait + timeout:
+                self.sleep(self.time_constant)
+                current = float(self.read('x'))
+                if abs(current - previous) <= accuracy * max(abs(current), abs(previous)):
+                    break
+                previous = current
+        return self.clock() - start
+
+    def acquire(self, rate=10000, length=500, curve='x'):
+        # Take a block of data from the fast buffer, only sending settings that have changed
+        return self.acquire_curves(rate, length, (curve,))[0]
+
+    def acquire_ranged(self, rate=10000, length=500, curves=('x',), autorange=True):
+        # Take data, auto-ranging and taking it again only if the signal (the first curve) is out of range.
+        # The signal is scaled to the sensitivity at the start of the run
+        data = self.acquire_curves(rate, length, curves)
+        self.range_status = self.check_range(data[0])
+        if self.range_status and autorange:
+            self.auto_sensitivity()
+            data = self.acquire_curves(rate, length, curves)
+        data[0] = data[0] * self.sensitivity_scale()
+        return data
+
+    def acquire_curves(self, rate=10000, length=500, curves=('x',)):
+        # Take a block of data and read several curves (e.g. 'x' and 'adc2') recorded at the same time
+        self.configure({'fast_buffer.enabled': True,
+                        'fast_buffer.storage_interval': rate,
+                        'fast_buffer.length': length})
+        lockin = self.connect()
+        try:
+            lockin.take_data()  # Start data acquisition immediately.
+
+            # Wait for the data to be taken
+            while lockin.acquisition_status[0] == 'on':
+                self.sleep(0.1)
+
+            return [np.asarray(lockin.fast_buffer[curve], dtype=float) for curve in curves]
+        except Exception:
+            self.disconnect()
+            raise
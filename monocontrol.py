@@ -0,0 +1,75 @@
+"""
+Project: Grating Tester
+File: monocontrol.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Driver for the Bentham monochromator.
+
+The connection to the monochromator is opened once and kept, and the current wavelength is cached so that moves to the
+current wavelength are skipped. The monochromator changes grating and order sorting filter at fixed wavelengths (the
+switch-over table configured for the rig), and these changes are much slower than a normal move, so the driver reports which
+band a wavelength is in and counts the switch-overs made during a run.
+
+Dependencies:
+- bendev: communication with the Bentham monochromator (imported on first connection, so simulated monochromators
+  run without it)
+
+"""
+import numpy as np
+
+
+def open_bentham(serial_number=None):
+    # Connection to the monochromator with a serial number, or to the first one found
+    import bendev   # Bentham monochromator
+    return bendev.Device(serial_number=serial_number)
+
+
+class Monochromator:
+    def __init__(self, switch_wavelengths=(), open_device=None, serial_number=None):
+        # wavelengths (nm) at which the grating or filter changes, empty if not configured
+        self.switch_wavelengths = switch_wavelengths
+        # serial number of the monochromator, needed when several are connected to the computer
+        self.serial_number = serial_number
+        # opens the connection, replaced to run against a simulated monochromator
+        self.open_device = open_device or (lambda: open_bentham(self.serial_number))
+        self.device = None
+        self.wavelength = None  # last wavelength moved to (nm)
+        self.switches = 0   # grating or filter changes since the last reset
+
+    def connect(self):
+        if self.device is None:
+            self.device = self.open_device()
+            self.device.write("SYSTEM:REMOTE")
+        return self.device
+
+    def disconnect(self):
+        self.device = None
+        self.wavelength = None
+
+    def query(self, command):
+        return self.connect().query(command)
+
+    def write(self, command):
+        return self.connect().write(command)
+
+    def band(self, wavelength):
+        # Index of the grating/filter band that a wavelength is in
+        return int(np.searchsorted(self.switch_wavelengths, wavelength, side='right'))
+
+    def goto(self, wavelength):
+        # Move to a wavelength, returns False if already there
+        wavelength = float(wavelength)
+        if wavelength == self.wavelength:
+            return False
+        if self.wavelength is not None and self.band(wavelength) != self.band(self.wavelength):
+            self.switches += 1
+        try:
+            self.query("MONO:GOTO? %s" % wavelength)
+        except Exception:
+            # the position is unknown after a failed move
+            self.disconnect()
+            raise
+        self.wavelength = wavelength
+        return True
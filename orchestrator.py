@@ -0,0 +1,143 @@
+"""
+Project: Grating Tester
+File: orchestrator.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Runs the scans of several test rigs from one process.
+
+Each rig has its own job queue and worker thread, so the rigs scan at the same time and a rig only waits for its own
+instruments. A scan that fails (e.g. a lost instrument connection) is marked as failed in its rig's queue and that rig
+moves on to its next scan; the other rigs are not affected. The status of all the rigs (running scan, queued, done
+and failed scans, last message) can be read at any time as one combined view. Each rig can also be driven from scripts
+through its own control server (see controlserver.py), which streams the points and messages of the rig's scans.
+
+Usage:
+    orchestrator = Orchestrator(load_rigs("rigs.json"), queue_folder="C:/Users/gooding/Desktop/Automation")
+    orchestrator.submit("Bench 1", ScanJob({...}))
+    orchestrator.submit("Bench 2", ScanJob({...}))
+    orchestrator.start()
+    print(orchestrator.status_table())
+
+"""
+import os
+import time
+from collections import deque
+
+from jobqueue import JobQueue
+from controlserver import ControlServer
+
+# number of messages kept for each rig
+MESSAGE_HISTORY = 100
+
+
+class Orchestrator:
+    def __init__(self, rigs=(), queue_folder=None, echo=True):
+        # queue_folder holds the saved queue of each rig, echo prints the messages of the rigs
+        self.queue_folder = queue_folder
+        self.echo = echo
+        self.rigs = {}
+        self.queues = {}
+        self.messages = {}
+        self.servers = {}   # control servers of each rig, which stream its scans to their clients
+        for rig in rigs:
+            self.add_rig(rig)
+
+    def add_rig(self, rig):
+        if not rig.name:
+            raise ValueError("Rigs run by the orchestrator need a name")
+        if rig.name in self.rigs:
+            raise ValueError(f"There is already a rig called {rig.name}")
+        path = os.path.join(self.queue_folder, f"scan_queue{rig.file_tag}.json") if self.queue_folder else None
+        self.rigs[rig.name] = rig
+        self.queues[rig.name] = JobQueue(path)
+        self.messages[rig.name] = deque(maxlen=MESSAGE_HISTORY)
+        self.servers[rig.name] = []
+        return rig
+
+    def log(self, name, message):
+        self.messages[name].append((time.time(), message))
+        if self.echo:
+            print(f"[{name}] {message}")
+        for server in self.servers[name]:
+            server.send_message(message)
+
+    def send_point(self, name, job_id, *point):
+        # Point measured by a scan of a rig for the clients of its control servers
+        for server in self.servers[name]:
+            server.send_point(job_id, *point)
+
+    def submit(self, name, job):
+        return self.queues[name].add(job)
+
+    def run_job(self, name, job):
+        # Run one scan on a rig, called in the worker thread of the rig
+        self.log(name, f"Starting scan {job.describe()}")
+        try:
+            self.rigs[name].run_scan(job, checkpoint=self.queues[name].checkpoint,
+                                     output=lambda message: self.log(name, message),
+                                     on_point=lambda *point: self.send_point(name, job.job_id, *point))
+        except Exception as error:
+            self.log(name, f"Scan {job.job_id} stopped: {type(error).__name__}: {error}")
+            raise
+        self.log(name, f"Scan {job.job_id} completed")
+
+    def start(self, names=None):
+        # Start the workers of the rigs (all rigs by default), returns the names of the rigs started
+        started = []
+        for name in names or self.rigs:
+            if self.queues[name].start(lambda job, name=name: self.run_job(name, job)):
+                started.append(name)
+        return started
+
+    def control_server(self, name, **options):
+        # Control server for one rig, scans submitted to it go to the queue of the rig (options as ControlServer)
+        # and the messages and points of the rig's scans are streamed to its clients
+        server = ControlServer(self.rigs[name], self.queues[name], start_queue=lambda: self.start([name]), **options)
+        self.servers[name].append(server)
+        return server
+
+    def wait(self, timeout=None):
+        # Wait for the workers to finish their queues, returns True if they all finished
+        end = None if timeout is None else time.time() + timeout
+        for queue in self.queues.values():
+            if queue.worker is not None:
+                queue.worker.join(None if end is None else max(end - time.time(), 0))
+        return not any(queue.is_running() for queue in self.queues.values())
+
+    def pause(self, name=None):
+        for queue in ([self.queues[name]] if name else self.queues.values()):
+            queue.pause()
+
+    def resume(self, name=None):
+        for queue in ([self.queues[name]] if name else self.queues.values()):
+            queue.resume()
+
+    def skip(self, name):
+        self.queues[name].skip()
+
+    def status(self):
+        # Combined status of the rigs, one dict per rig
+        rows = []
+        for name, queue in self.queues.items():
+            with queue.lock:
+                counts = {state: sum(job.status == state for job in queue.jobs)
+                          for state in ('queued', 'done', 'skipped', 'failed')}
+                current = queue.current
+                failed = [job for job in queue.jobs if job.status == 'failed']
+            messages = self.messages[name]
+            rows.append({'rig': name, 'running': queue.is_running(), 'paused': queue.is_paused(),
+                         'current_job': current.describe() if current else None, **counts,
+                         'last_error': failed[-1].message if failed else None,
+                         'last_message': messages[-1][1] if messages else None})
+        return rows
+
+    def status_table(self):
+        # Status of the rigs as text, one line per rig
+        lines = [f"{'Rig':<12} {'State':<8} {'Queued':>6} {'Done':>5} {'Failed':>6}  Current scan / last error"]
+        for row in self.status():
+            state = "paused" if row['paused'] and row['running'] else "running" if row['running'] else "idle"
+            detail = row['current_job'] or (f"error: {row['last_error']}" if row['last_error'] else "")
+            lines.append(f"{row['rig']:<12} {state:<8} {row['queued']:>6} {row['done']:>5} {row['failed']:>6}  {detail}")
+        return "\n".join(lines)
@@ -0,0 +1,146 @@
+"""
+Project: Grating Tester
+File: resultstore.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Binary store and browser for (x, y, wavelength) result cubes.
+
+A cube is saved as a folder '<name>.cube' holding one .npy file per axis and per quantity (e.g. signal and signal std,
+shaped (x, y, wavelength)), a metadata.json file and downsampled previews of the maps at each wavelength. Extra fields
+of each point that are not measured quantities (e.g. the time, sensitivity and flags) are saved at full resolution in
+their own dtype and have no previews, since a mean of them is meaningless. Cubes are
+opened as memory-mapped arrays, so only the slice being viewed (one spectrum or one wavelength map) is read from disk
+and large maps open straight away with bounded memory. The previews are stored wavelength first, so a map for panning
+is a single contiguous read.
+
+Dependencies:
+- numpy, matplotlib
+
+"""
+import json
+import os
+import numpy as np
+from matplotlib import pyplot as plt
+
+CUBE_SUFFIX = ".cube"
+AXES = ('wavelengths', 'x_steps', 'y_steps')
+
+
+def downsample(cube, factor):
+    # Mean over factor x factor blocks of each wavelength map, returns an array shaped (wavelength, x, y)
+    nx, ny, nw = cube.shape
+    px, py = -nx % factor, -ny % factor
+    padded = np.pad(np.asarray(cube, dtype=float), ((0, px), (0, py), (0, 0)), constant_values=np.nan)
+    blocks = padded.reshape((nx + px) // factor, factor, (ny + py) // factor, factor, nw)
+    counts = np.sum(~np.isnan(blocks), axis=(1, 3))
+    sums = np.nansum(blocks, axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    return np.ascontiguousarray(means.transpose(2, 0, 1))
+
+
+def save_cube(path, wavelengths, x_steps, y_steps, quantities, metadata=None, min_preview=4, extras=None):
+    # Save a cube, quantities is a dict of arrays shaped (x, y, wavelength), e.g. {'signal': ..., 'signal_std': ...},
+    # extras is a dict of arrays of the same shape saved as they are, without previews, e.g. {'flags': ...}
+    if not path.endswith(CUBE_SUFFIX):
+        path += CUBE_SUFFIX
+    os.makedirs(path, exist_ok=True)
+    for name, values in zip(AXES, (wavelengths, x_steps, y_steps)):
+        np.save(os.path.join(path, name + ".npy"), np.asarray(values, dtype=float))
+    previews = []
+    for name, cube in quantities.items():
+        cube = np.asarray(cube, dtype=float)
+        np.save(os.path.join(path, name + ".npy"), cube)
+        # previews halve the map size each level until the map is smaller than min_preview
+        factor = 2
+        while max(cube.shape[0], cube.shape[1]) // factor >= min_preview:
+            np.save(os.path.join(path, f"{name}_preview{factor}.npy"), downsample(cube, factor))
+            if factor not in previews:
+                previews.append(factor)
+            factor *= 2
+    extras = extras or {}
+    for name, cube in extras.items():
+        np.save(os.path.join(path, name + ".npy"), np.asarray(cube))
+    info = dict(metadata or {})
+    info['quantities'] = list(quantities)
+    info['extras'] = list(extras)
+    info['previews'] = previews
+    with open(os.path.join(path, "metadata.json"), 'w') as f:
+        json.dump(info, f, indent=1)
+    return path
+
+
+class ResultCube:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "metadata.json")) as f:
+            self.metadata = json.load(f)
+        # the axes are small and are loaded in full
+        self.wavelengths, self.x_steps, self.y_steps = [np.load(os.path.join(path, name + ".npy")) for name in AXES]
+        self.arrays = {}    # memory-mapped quantities and previews, opened on first use
+
+    @property
+    def quantities(self):
+        return self.metadata['quantities']
+
+    @property
+    def extras(self):
+        return self.metadata.get('extras', [])
+
+    @property
+    def shape(self):
+        return len(self.x_steps), len(self.y_steps), len(self.wavelengths)
+
+    def data(self, name='signal'):
+        # Memory-mapped cube for a quantity or an extra field, shaped (x, y, wavelength)
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.path, name + ".npy"), mmap_mode='r')
+        return self.arrays[name]
+
+    def preview(self, name, factor):
+        key = f"{name}_preview{factor}"
+        if key not in self.arrays:
+            self.arrays[key] = np.load(os.path.join(self.path, key + ".npy"), mmap_mode='r')
+        return self.arrays[key]
+
+    def index(self, wavelength):
+        # Index of the wavelength closest to the one given
+        return int(np.argmin(np.abs(self.wavelengths - wavelength)))
+
+    def spectrum(self, i, j, name='signal'):
+        # Spectrum at one (x, y) position, only this spectrum is read from disk
+        return np.array(self.data(name)[i, j, :])
+
+    def wavelength_map(self, k, name='signal', step=1):
+        # Map at one wavelength index. With step > 1 the largest preview whose factor divides step is used, so panning
+        # over a large map reads a small contiguous array with the same shape as the map taken from the full data.
+        # Extra fields have no previews and are always read from the full data
+        factors = [factor for factor in self.metadata['previews'] if step % factor == 0 and name in self.quantities]
+        if factors:
+            factor = max(factors)
+            return np.array(self.preview(name, factor)[k, ::step // factor, ::step // factor])
+        return np.array(self.data(name)[::step, ::step, k])
+
+    def close(self):
+        self.arrays = {}
+
+
+def plot_spectrum(cube, i, j, name='signal'):
+    plt.plot(cube.wavelengths, cube.spectrum(i, j, name), 'o-', color='black')
+    plt.xlabel('Wavelength (nm)')
+    plt.ylabel(name)
+    plt.title(f"X = {cube.x_steps[i]} mm, Y = {cube.y_steps[j]} mm")
+    plt.show()
+
+
+def plot_map(cube, wavelength, name='signal', step=1):
+    k = cube.index(wavelength)
+    plt.imshow(cube.wavelength_map(k, name, step).T, origin='lower', aspect='auto',
+               extent=(cube.x_steps[0], cube.x_steps[-1], cube.y_steps[0], cube.y_steps[-1]))
+    plt.colorbar(label=name)
+    plt.xlabel('X step (mm)')
+    plt.ylabel('Y step (mm)')
+    plt.title(f"{cube.wavelengths[k]} nm")
+    plt.show()
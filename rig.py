@@ -0,0 +1,473 @@
+"""
+Project: Grating Tester
+File: rig.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Test rig and scan engine.
+
+A rig is one test bench: its instrument addresses (stage COM ports, lock-in IP address), its calibration constants
+(translation stage steps per mm, lock-in signal scaling, rotation stage degrees per unit) and the driver objects for
+its instruments, which keep their connections open between scans. The scan engine runs a scan job (see jobqueue.py)
+on a rig without using the GUI, so several rigs can run scans at the same time (see orchestrator.py) and the same
+engine runs against simulated instruments (see simrig.py).
+
+Rigs can be described in a json file, e.g.
+    [{"name": "Bench 1", "x_port": "COM4", "y_port": "COM5", "lockin_address": ["169.254.150.230", 50000],
+      "monochromator_serial": "23001", "rotation_serials": [90000001, 90000002]},
+     {"name": "Bench 2", "x_port": "COM6", "y_port": "COM7", "lockin_address": ["169.254.150.232", 50000],
+      "monochromator_serial": "23002", "rotation_serials": [90000003, 90000004]}]
+The monochromator and rotation stages are chosen by serial number, so several rigs can run from one computer. Without
+serial numbers the first monochromator and the first two rotation stages found are used. Scans are checked against
+"travel_limits" (mm, relative to the controller zero) and "wavelength_range" (nm) if they are given, taken from the
+set up of each bench: the usable travel of its translation stages as mounted and the range of the gratings and
+filters installed in its monochromator. "switch_wavelengths" (nm) must match the switch-over table set up in the
+monochromator, the wavelengths of a scan are then ordered to minimise grating and filter changes, otherwise they are
+measured in the order of the scan.
+
+The GUI runs the first rig of "rig.json" in its working folder, or a rig with the default settings if there is no
+rig file.
+
+Usage:
+    rig = Rig()
+    result = rig.run_scan(ScanJob({'wavelength_start': "800", 'wavelength_stop': "900", 'wavelength_step': "10",
+                                   'root_folder': "C:/Users/gooding/Desktop/Automation/Results"}))
+
+"""
+import csv
+import json
+import os
+import re
+import time
+from threading import Thread, RLock
+import numpy as np
+
+from monocontrol import Monochromator  # Bentham monochromator
+from lockincontrol import LockIn, acquire_pair, ratio_statistics, slope_db    # Lock-in amplifier
+from stagecontrol import TranslationStage, RotationStages  # Newmark and Thorlabs stages
+from scanplan import ScanPlan, CostModel
+from resultstore import save_cube
+from runcatalog import RunCatalog
+from gainmap import GainMap
+from jobqueue import JobSkipped
+from scandata import ScanData, OVERLOAD, UNDER_RANGE, AUTORANGED
+
+# rig file of the GUI, in the working folder
+RIG_FILE = "rig.json"
+# settings of a rig that can be given in a rig file
+RIG_SETTINGS = ('name', 'x_port', 'y_port', 'lockin_address', 'monochromator_serial', 'rotation_serials',
+                'travel_limits', 'wavelength_range', 'steps_per_mm', 'signal_scale', 'degrees_per_unit',
+                'switch_wavelengths')
+
+
+class Rig:
+    def __init__(self, name=None, x_port='COM4', y_port='COM5', lockin_address=('169.254.150.230', 50000),
+                 monochromator_serial=None, rotation_serials=None, travel_limits=None, wavelength_range=None,
+                 steps_per_mm=8.0645, signal_scale=200, degrees_per_unit=5.5,
+                 switch_wavelengths=(), open_port=None, open_monochromator=None,
+                 open_lockin=None, apt=None, sleep=None, clock=None):
+        # name is None for the single rig of the GUI, the open_* factories and apt replace the instrument libraries
+        # and sleep and clock replace time.sleep and time.time (e.g. with simulated instruments or a replay)
+        self.name = name
+        self.x_port = x_port
+        self.y_port = y_port
+        self.lockin_address = tuple(lockin_address)
+        self.monochromator_serial = monochromator_serial
+        self.rotation_serials = None if rotation_serials is None else list(rotation_serials)
+        # (low, high) limits that scans are checked against, None if not configured
+        self.travel_limits = None if travel_limits is None else tuple(travel_limits)
+        self.wavelength_range = None if wavelength_range is None else tuple(wavelength_range)
+        self.steps_per_mm = steps_per_mm
+        self.signal_scale = signal_scale
+        self.degrees_per_unit = degrees_per_unit
+        self.switch_wavelengths = tuple(switch_wavelengths or ())
+        self.open_lockin = open_lockin
+        self.sleeper = sleep or time.sleep
+        self.clock = clock or time.time
+
+        # Translation stages, the serial ports are opened on first use and kept open
+        self.x_stage = TranslationStage(x_port, steps_per_mm, open_port=open_port)
+        self.y_stage = TranslationStage(y_port, steps_per_mm, open_port=open_port)
+        # Rotation stages, enumerated once and the Motor objects kept
+        self.rotation_stages = RotationStages(degrees_per_unit, apt=apt, serial_numbers=self.rotation_serials)
+        # Monochromator, the connection is kept and the current wavelength cached
+        self.monochromator = Monochromator(self.switch_wavelengths, open_device=open_monochromator,
+                                           serial_number=monochromator_serial)
+        # Lock-in amplifier, the connection is kept and its settings mirrored
+        self.lockin = LockIn(self.lockin_address, open_device=open_lockin, sleep=self.sleep, clock=self.clock)
+        # Second lock-in for the monitor detector (optional), connected when a run needs it
+        self.monitor_lockin = None
+        # Only one scan or command uses the instruments at a time
+        self.hardware_lock = RLock()
+
+    @classmethod
+    def from_config(cls, config, **factories):
+        unknown = set(config) - set(RIG_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown rig settings: {sorted(unknown)}")
+        return cls(**config, **factories)
+
+    def to_config(self):
+        return {'name': self.name, 'x_port': self.x_port, 'y_port': self.y_port,
+                'lockin_address': list(self.lockin_address), 'monochromator_serial': self.monochromator_serial,
+                'rotation_serials': self.rotation_serials,
+                'travel_limits': None if self.travel_limits is None else list(self.travel_limits),
+                'wavelength_range': None if self.wavelength_range is None else list(self.wavelength_range),
+                'steps_per_mm': self.steps_per_mm,
+                'signal_scale': self.signal_scale, 'degrees_per_unit': self.degrees_per_unit,
+                'switch_wavelengths': list(self.switch_wavelengths)}
+
+    def sleep(self, seconds):
+        # All waits of the scan go through the rig, so that simulated rigs and replays can run faster than real time
+        self.sleeper(seconds)
+
+    @property
+    def file_tag(self):
+        # Part of the file names written by the rig that keeps the files of rigs sharing a folder apart,
+        # empty for the single rig of the GUI
+        if self.name is None:
+            return ""
+        return "_" + re.sub(r'[^\w.-]+', '_', self.name)
+
+    def timings_file(self, folder):
+        # Run timings are kept per rig, as each bench has its own move and settling times
+        return os.path.join(folder, f"run_timings{self.file_tag}.json")
+
+    def output_path(self, job, suffix):
+        # Path of a results file of a job, named by the time, the rig and the job file name
+        timestr = time.strftime("%Y%m%d-%H%M%S")
+        return f"{job['root_folder']}/{timestr}{self.file_tag}_{job['file_name']}{suffix}"
+
+    def convert_signal(self, signal):
+        # Convert the signal from the lock-in amplifier to a voltage with the signal scale of the rig
+        return float(signal) / self.signal_scale
+
+    def convert_monitor(self, signal, channel):
+        # The second lock-in is scaled like the signal, the ADC input is left in volts
+        if channel == "Second lock-in":
+            return self.convert_signal(signal)
+        return float(signal)
+
+    def connect_monitor_lockin(self, host):
+        # Second lock-in for the monitor detector, reconnected if the address has changed
+        address = (host, 50000)
+        if self.monitor_lockin is None or self.monitor_lockin.address != address:
+            self.monitor_lockin = LockIn(address, open_device=self.open_lockin, sleep=self.sleep, clock=self.clock)
+        return self.monitor_lockin.connect()
+
+    def acquisition(self, rate: int = 10000, length: int = 500, autorange=True):
+        # Take data from the lock-in, the fast buffer settings are only sent if they have changed
+        # and the sensitivity is only auto-ranged if the signal is out of range
+        x, = self.lockin.acquire_ranged(rate, length, autorange=autorange)
+
+        # Return the data
+        return self.convert_signal(np.mean(x)), self.convert_signal(np.std(x))
+
+    def dual_acquisition(self, channel, rate: int = 10000, length: int = 500, autorange=True):
+        # Take the signal and monitor together and compute the signal/monitor ratio and its uncertainty
+        if channel == "Second lock-in":
+            x, m = acquire_pair(self.lockin, self.monitor_lockin, rate, length, autorange=autorange)
+        else:
+            x, m = acquire_pair(self.lockin, None, rate, length, monitor_curve='adc2', autorange=autorange)
+        ratio, ratio_std = ratio_statistics(x, m)
+        scale = self.convert_signal(1) / self.convert_monitor(1, channel)
+
+        # Return the data
+        return (self.convert_signal(np.mean(x)), self.convert_signal(np.std(x)),
+                self.convert_monitor(np.mean(m), channel), self.convert_monitor(np.std(m), channel),
+                ratio * scale, ratio_std * scale)
+
+    def preset_sensitivity(self, sensitivity, errors):
+        # Set the lock-in sensitivity, run in a thread while the monochromator moves, errors are added to the list
+        try:
+            self.lockin.set_sensitivity(sensitivity)
+        except Exception as error:
+            errors.append(error)
+
+    def reset_buffers(self):
+        # Reset the input buffers of the translation stages
+        self.x_stage.reset_input_buffer()
+        self.y_stage.reset_input_buffer()
+
+    def check_stage_positions(self, output=print):
+        # Read the stage positions back from the controllers and report any drift from the cached positions
+        for name, stage in (("X", self.x_stage), ("Y", self.y_stage)):
+            drift = stage.checkpoint()
+            if drift is None:
+                output(f"{name} position could not be read back, using cached position.")
+            elif abs(drift) > 1e-3:
+                output(f"{name} position corrected by {drift:.4f} mm")
+
+    def build_plan(self, job):
+        # Scan plan from the job settings, relative to the cached stage positions
+        plan = ScanPlan.from_entries(job['wavelength_start'], job['wavelength_stop'], job['wavelength_step'],
+                                     job['x_step_size'], job['x_step_number'],
+                                     job['y_step_size'], job['y_step_number'],
+                                     self.x_stage.position(), self.y_stage.position(),
+                                     switch_wavelengths=self.switch_wavelengths,
+                                     current_wavelength=self.monochromator.wavelength,
+                                     settle_accuracy=job['settle_accuracy'])
+        # the settling wait per point is known once the lock-in is connected and its filter settings read,
+        # they are read again at the start of each run
+        if self.lockin.device is not None and self.lockin.time_constant is not None:
+            plan.settle_time = self.lockin.settle_time(plan.settle_accuracy)
+        return plan
+
+    def validate_plan(self, plan):
+        # Problems with a plan on this rig, empty if it can be run
+        return plan.validate(self.travel_limits, self.wavelength_range)
+
+    def unchecked_limits(self):
+        # Messages for the limits that scans cannot be checked against because they are not configured for the rig
+        messages = []
+        if self.travel_limits is None:
+            messages.append("Stage travel limits are not configured, scan positions are not checked.")
+        if self.wavelength_range is None:
+            messages.append("Monochromator range is not configured, scan wavelengths are not checked.")
+        return messages
+
+    def run_scan(self, job, checkpoint=None, output=print, on_point=None):
+        # Run a scan job, holding the hardware lock. checkpoint() is called before each point (it may wait, or raise
+        # JobSkipped to stop the scan), output(message) reports progress and on_point(wavelength, x, y, values) is
+        # called after each point. Raises ValueError if the job settings are invalid
+        with self.hardware_lock:
+            try:
+                result = self.recorded_scan(job, checkpoint, output, on_point)
+            finally:
+                # readings after the run (e.g. remote commands) are not scaled to the start of the run
+                for lockin in (self.lockin, self.monitor_lockin):
+                    if lockin is not None:
+                        lockin.end_run()
+        # the run is added to the catalog of the results folder once the instruments are free for the next scan,
+        # as the first update of a folder reads the whole archive
+        if result['filename']:
+            catalog = RunCatalog(job['root_folder'])
+            catalog.update()
+            catalog.close()
+        if result['skipped']:
+            raise JobSkipped()
+        return result
+
+    def recorded_scan(self, job, checkpoint, output, on_point):
+        if not job['record_io']:
+            return self.scan(job, checkpoint, output, on_point)
+        # record the instrument I/O of the scan so that it can be replayed offline (see iorecord.py)
+        from iorecord import Recorder
+        path = self.output_path(job, ".io.jsonl")
+        recorder = Recorder(path, self, job)
+        output(f"Recording instrument I/O to {path}")
+        try:
+            return self.scan(job, checkpoint, output, on_point)
+        finally:
+            recorder.close()
+
+    def scan(self, job, checkpoint, output, on_point):
+        start_time = self.clock()
+
+        # check the settings before using the instruments, then build the plan from the stage positions read back,
+        # scan positions are relative to where the stages are at the start of the run
+        self.build_plan(job)
+        self.check_stage_positions(output)
+        plan = self.build_plan(job)
+        problems = self.validate_plan(plan)
+        if problems:
+            raise ValueError(" ".join(problems))
+        wavelengths = plan.wavelengths
+        x_steps = plan.x_steps
+        y_steps = plan.y_steps
+        x_origin = plan.x_origin
+        y_origin = plan.y_origin
+        cost_model = CostModel(self.timings_file(job['root_folder']))
+
+        # rotate the grating to the angles of the job, the rotation stages are left where they are if no angle is given
+        for index, angle in enumerate((job['rotation1'], job['rotation2'])):
+            if str(angle).strip():
+                self.rotation_stages.move_to(index, float(angle), blocking=True)
+                output(f"Rotation {index + 1} set to: {float(angle)} degrees")
+
+        # read a monitor detector at the same time as the signal to remove lamp drift
+        channel = job['monitor_channel']
+        monitor = channel != "None"
+        if channel == "Second lock-in":
+            self.connect_monitor_lockin(job['monitor_address'])
+            self.monitor_lockin.prepare_run()
+
+        # Create csv file to save data
+        save_data = job['save_data']
+        filename = None
+        if save_data:
+            output("Creating csv file...")
+            filename = self.output_path(job, ".csv")
+
+            # save header information
+            header_line = "Wavelength (nm),X step (mm),Y step (mm),Signal (mV),Signal std (mV)"
+            if monitor:
+                header_line += ",Monitor,Monitor std,Ratio,Ratio std"
+
+            with open(filename, mode='w', newline='') as csv_file:
+                csv_writer = csv.writer(csv_file)
+                csv_writer.writerow(header_line.split(','))
+            output(f"File created: {filename}")
+
+        output(f"Wavelengths: {wavelengths}")
+        output(f"X steps: {x_steps}")
+        output(f"Y steps: {y_steps}")
+
+        # configure the lock-in once for the run and check its settings
+        corrected = self.lockin.prepare_run()
+        if corrected:
+            output(f"Lock-in settings corrected: {corrected}")
+
+        # settling time per point from the lock-in time constant and filter slope
+        settle_accuracy = plan.settle_accuracy
+        plan.settle_time = self.lockin.settle_time(settle_accuracy)
+        output(f"Lock-in settling time: {plan.settle_time:.3f} s "
+               f"(time constant {self.lockin.time_constant} s, slope {slope_db(self.lockin.slope):g} dB/octave)")
+
+        # sensitivities that worked for this grating in previous runs
+        grating_id = job['grating_id']
+        gain_ranging = job['gain_ranging']
+        gain_map = GainMap(os.path.join(job['root_folder'], "gain_map.json"))
+
+        # sleep for 1 second to allow the user to see the message
+        self.sleep(1)
+
+        # Run the experiment, the points are stored in one dataset preallocated for the whole scan
+        data = ScanData(wavelengths, x_steps, y_steps, monitor=monitor)
+
+        # loop through the wavelengths, in the order that minimises monochromator grating and filter changes
+        self.monochromator.switches = 0
+        # the queue can pause or skip the scan between points, a skipped scan keeps the points measured so far
+        skipped = False
+        try:
+            for k in plan.order:
+                # confirm the stage positions once per wavelength
+                if k != plan.order[0]:
+                    self.check_stage_positions(output)
+
+                # wavelength loop
+                wavelength = wavelengths[k]
+                # preset the lock-in sensitivity for this wavelength while the monochromator moves
+                gain = gain_map.lookup(grating_id, wavelength) if gain_ranging else None
+                preset_errors = []
+                if gain is not None:
+                    gain_thread = Thread(target=self.preset_sensitivity, args=(gain, preset_errors))
+                    gain_thread.start()
+                self.monochromator.goto(wavelength)
+                if gain is not None:
+                    gain_thread.join()
+                if preset_errors:
+                    # a failed write disconnects the lock-in and its sensitivity is unknown, read it back so that
+                    # the readings are still scaled to the start of the run (auto-ranging corrects it if needed)
+                    sensitivity = self.lockin.read_sensitivity()
+                    output(f"Lock-in sensitivity preset to {gain} failed at {wavelength} nm "
+                           f"({type(preset_errors[0]).__name__}: {preset_errors[0]}), continuing at {sensitivity}")
+
+                # loop through the x steps
+                for i in range(len(x_steps)):
+
+                    # reset buffers
+                    self.reset_buffers()
+
+                    x_step = x_steps[i]
+
+                    # return y to 0 and move x to the next step, moves already at the target are skipped
+                    if self.y_stage.move_to(y_origin + y_steps[0]):
+                        self.sleep(4)
+                    if self.x_stage.move_to(x_origin + x_step):
+                        self.sleep(2)
+
+                    # reset buffers
+                    self.reset_buffers()
+
+                    # loop through the y steps
+                    for j in range(len(y_steps)):
+                        y_step = y_steps[j]
+                        # wait here while the queue is paused, stop if the scan is skipped
+                        if checkpoint is not None:
+                            checkpoint()
+
+                        # move y to the next step
+                        if self.y_stage.move_to(y_origin + y_step):
+                            self.sleep(1)
+
+                        # wait for the lock-in output to settle after the last move or wavelength change
+                        self.lockin.wait_settled(settle_accuracy, monitor=job['monitor_settling'])
+
+                        # take the measurement, with the monitor and the signal/monitor ratio if selected
+                        if monitor:
+                            values = self.dual_acquisition(channel, autorange=gain_ranging)
+                        else:
+                            values = self.acquisition(autorange=gain_ranging)
+                        flags = 0
+                        sensitivity = self.lockin.settings.get('sensitivity')
+                        if gain_ranging:
+                            if self.lockin.range_status:
+                                output(f"Lock-in auto-ranged ({self.lockin.range_status}) at {wavelength} nm")
+                                flags = AUTORANGED | (OVERLOAD if self.lockin.range_status == 'overload'
+                                                      else UNDER_RANGE)
+                            gain_map.record(grating_id, wavelength, sensitivity)
+                        data.record(k, i, j, values, timestamp=self.clock(), sensitivity=sensitivity, flags=flags)
+                        row = ", ".join(str(value) for value in (wavelength, x_step, y_step) + tuple(values))
+                        output(row)
+
+                        if save_data:
+                            # save the data to a file
+                            with open(filename, 'a') as f:
+                                f.write(row + "\n")
+
+                        if on_point is not None:
+                            on_point(wavelength, x_step, y_step, values)
+        except JobSkipped:
+            skipped = True
+            output("Scan skipped, returning the stages and saving the points measured.")
+
+        # return x to 0
+        output("Returning to x = 0")
+        if self.x_stage.move_to(x_origin):
+            self.sleep(2)
+        # return y to 0
+        output("Returning to y = 0")
+        if self.y_stage.move_to(y_origin):
+            self.sleep(2)
+        self.check_stage_positions(output)
+        # return wavelength to start position, unless it needs a grating or filter change
+        if self.monochromator.band(wavelengths[0]) == self.monochromator.band(self.monochromator.wavelength):
+            output("Returning wavelength to start position.")
+            self.monochromator.goto(float(wavelengths[0]))
+        output(f"Monochromator grating/filter changes: {self.monochromator.switches}")
+        gain_map.save()
+
+        duration = self.clock() - start_time
+
+        # save the results as a cube that can be browsed without loading the whole file, points not measured are NaN
+        if save_data:
+            cube_path = save_cube(filename[:-len(".csv")], wavelengths, x_steps, y_steps, data.quantities(),
+                                  {'name': job['file_name'], 'csv': os.path.basename(filename),
+                                   'grating_id': job['grating_id'], 'duration': duration,
+                                   'rotation1': job['rotation1'], 'rotation2': job['rotation2'],
+                                   'rig': self.name},
+                                  extras=data.extras())
+            output(f"Cube saved to {cube_path}")
+
+        # record the duration of the run to calibrate the run time estimates, skipped runs are not complete
+        if not skipped:
+            cost_model.record(plan, duration)
+
+        return {'filename': filename, 'duration': duration, 'wavelengths': wavelengths, 'x_steps': x_steps,
+                'y_steps': y_steps, 'data': data, 'signal': data.field('signal'),
+                'signal_std': data.field('signal_std'), 'skipped': skipped}
+
+
+def load_rigs(path, **factories):
+    # Rigs described in a json file, a list of rig settings
+    with open(path) as f:
+        return [Rig.from_config(config, **factories) for config in json.load(f)]
+
+
+def load_bench(path=RIG_FILE, **factories):
+    # Rig of the GUI, the first rig of the rig file, or a rig with the default settings if there is no rig file
+    if os.path.exists(path):
+        return load_rigs(path, **factories)[0]
+    return Rig(**factories)
@@ -0,0 +1,162 @@
+"""
+Project: Grating Tester
+File: runcatalog.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Indexed catalog of the runs saved in a results folder.
+
+Each run is saved as '<timestamp>_<name>.csv'. The catalog is a SQLite database (catalog.sqlite) in the results folder
+holding the metadata of every run: grating ID, scan ranges, point counts, timing and summary metrics of the signal.
+Updating the catalog only reads the files which are new or have changed since the last update, and queries (e.g. all
+runs of one grating covering a wavelength band) are answered from the index without opening any data files.
+
+The run name, grating ID and run duration are taken from the cube metadata saved with the run when it exists. For
+older runs the name is taken from the file name, the duration from the file timestamps and the grating ID is left
+empty (NULL), as the file name holds the run name rather than the grating ID.
+
+Usage:
+    catalog = RunCatalog("C:/Users/gooding/Desktop/Automation/Results")
+    catalog.update()
+    runs = catalog.find(grating_id="VPHG-01", wavelength=(800, 900))
+
+Dependencies:
+- numpy, sqlite3
+
+"""
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+
+from csvloader import load_csv
+from resultstore import CUBE_SUFFIX
+
+CATALOG_NAME = "catalog.sqlite"
+# longest plausible run (s), used when the duration is taken from the file timestamps
+MAX_RUN_DURATION = 7 * 24 * 3600
+
+COLUMNS = (('file', 'TEXT PRIMARY KEY'), ('mtime', 'REAL'), ('size', 'INTEGER'),
+           ('name', 'TEXT'), ('grating_id', 'TEXT'), ('started', 'TEXT'), ('duration', 'REAL'),
+           ('wavelength_min', 'REAL'), ('wavelength_max', 'REAL'), ('wavelength_count', 'INTEGER'),
+           ('x_min', 'REAL'), ('x_max', 'REAL'), ('x_count', 'INTEGER'),
+           ('y_min', 'REAL'), ('y_max', 'REAL'), ('y_count', 'INTEGER'),
+           ('points', 'INTEGER'), ('columns', 'INTEGER'),
+           ('signal_mean', 'REAL'), ('signal_min', 'REAL'), ('signal_max', 'REAL'))
+
+
+def parse_file_name(file_name):
+    # Start time and run name from '<timestamp>_<name>.csv', the start time is None if there is no timestamp
+    stem = os.path.splitext(file_name)[0]
+    timestamp, _, name = stem.partition('_')
+    try:
+        started = time.strptime(timestamp, "%Y%m%d-%H%M%S")
+    except ValueError:
+        return None, stem
+    return started, name
+
+
+def summarise(folder, file_name):
+    # Catalog entry for one result file
+    path = os.path.join(folder, file_name)
+    stat = os.stat(path)
+    started, name = parse_file_name(file_name)
+    entry = {'file': file_name, 'mtime': stat.st_mtime, 'size': stat.st_size, 'name': name,
+             'grating_id': None,
+             'started': time.strftime("%Y-%m-%d %H:%M:%S", started) if started else None,
+             'duration': None}
+    # the file was last written at the end of the run, unless it has been copied or edited since
+    if started and 0 <= stat.st_mtime - time.mktime(started) <= MAX_RUN_DURATION:
+        entry['duration'] = stat.st_mtime - time.mktime(started)
+
+    # metadata saved with the run
+    metadata_path = os.path.join(folder, os.path.splitext(file_name)[0] + CUBE_SUFFIX, "metadata.json")
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        # the file name of a named rig also holds the rig name, the metadata has the run name alone
+        entry['name'] = metadata.get('name') or entry['name']
+        entry['grating_id'] = metadata.get('grating_id') or None
+        entry['duration'] = metadata.get('duration', entry['duration'])
+
+    columns = load_csv(path)
+    entry['points'] = len(columns['wavelength'])
+    entry['columns'] = len(columns)
+    for axis in ('wavelength', 'x', 'y'):
+        values = columns[axis][~np.isnan(columns[axis])]
+        entry[f'{axis}_min'] = float(np.min(values)) if len(values) else None
+        entry[f'{axis}_max'] = float(np.max(values)) if len(values) else None
+        entry[f'{axis}_count'] = len(np.unique(values))
+    signal = columns.get('signal', np.array([]))
+    signal = signal[~np.isnan(signal)]
+    entry['signal_mean'] = float(np.mean(signal)) if len(signal) else None
+    entry['signal_min'] = float(np.min(signal)) if len(signal) else None
+    entry['signal_max'] = float(np.max(signal)) if len(signal) else None
+    return entry
+
+
+class RunCatalog:
+    def __init__(self, folder):
+        self.folder = folder
+        self.connection = sqlite3.connect(os.path.join(folder, CATALOG_NAME))
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs (%s)"
+                                    % ", ".join(f"{name} {kind}" for name, kind in COLUMNS))
+            self.connection.execute("CREATE INDEX IF NOT EXISTS runs_grating ON runs (grating_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS runs_wavelength "
+                                    "ON runs (wavelength_min, wavelength_max)")
+
+    def close(self):
+        self.connection.close()
+
+    def update(self):
+        # Index new and changed result files and remove files that have gone, returns the number of files indexed
+        known = {row['file']: (row['mtime'], row['size'])
+                 for row in self.connection.execute("SELECT file, mtime, size FROM runs")}
+        present = set()
+        indexed = 0
+        with self.connection:
+            for item in os.scandir(self.folder):
+                if not item.is_file() or not item.name.lower().endswith(".csv"):
+                    continue
+                present.add(item.name)
+                stat = item.stat()
+                if known.get(item.name) == (stat.st_mtime, stat.st_size):
+                    continue
+                try:
+                    entry = summarise(self.folder, item.name)
+                except (OSError, ValueError, KeyError):
+                    continue
+                self.connection.execute("INSERT OR REPLACE INTO runs (%s) VALUES (%s)"
+                                        % (", ".join(entry), ", ".join("?" * len(entry))), list(entry.values()))
+                indexed += 1
+            for file_name in set(known) - present:
+                self.connection.execute("DELETE FROM runs WHERE file = ?", (file_name,))
+        return indexed
+
+    def find(self, grating_id=None, wavelength=None, name=None):
+        # Runs matching a grating ID, a name (SQL LIKE pattern) and/or covering a wavelength or (start, stop) band
+        conditions = []
+        values = []
+        if grating_id is not None:
+            conditions.append("grating_id = ?")
+            values.append(grating_id)
+        if name is not None:
+            conditions.append("name LIKE ?")
+            values.append(name)
+        if wavelength is not None:
+            low, high = (wavelength, wavelength) if np.isscalar(wavelength) else wavelength
+            conditions.append("wavelength_max >= ? AND wavelength_min <= ?")
+            values.extend([low, high])
+        query = "SELECT * FROM runs"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY started"
+        return [dict(row) for row in self.connection.execute(query, values)]
+
+    def paths(self, **criteria):
+        # Full paths of the result files matching the criteria of find()
+        return [os.path.join(self.folder, run['file']) for run in self.find(**criteria)]
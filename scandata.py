@@ -0,0 +1,100 @@
+"""
+Project: Grating Tester
+File: scandata.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+In-memory dataset of a scan.
+
+The results of a scan are held in one structured numpy array, preallocated for the whole scan and shaped
+(x, y, wavelength) like the result cubes (see resultstore.py). Each element is one point: its coordinates, the signal
+mean and std (and the monitor and ratio when a monitor is read), the time it was measured, the lock-in sensitivity
+used and flags. The coordinates are filled in when the array is allocated and points that have not been measured are
+NaN, so the wavelength order of the scan does not matter and no flattened index arithmetic is needed.
+
+Spectra, wavelength maps, whole quantity cubes and the flat table of points are all views of the same array, so
+plotting, saving and analysis share the data without copying it.
+
+Usage:
+    data = ScanData(wavelengths, x_steps, y_steps)
+    data.record(k, i, j, (signal, signal_std), timestamp=time.time(), sensitivity=0.01)
+    data.spectrum(i, j)     # signal at one position, a view
+    data.wavelength_map(k)  # signal at one wavelength, a view
+    data.table()            # one row per point, a view
+
+"""
+import numpy as np
+
+COORDINATES = ('wavelength', 'x', 'y')
+VALUES = ('signal', 'signal_std')
+MONITOR_VALUES = ('monitor', 'monitor_std', 'ratio', 'ratio_std')
+
+# flags of a point
+MEASURED = 1
+OVERLOAD = 2
+UNDER_RANGE = 4
+AUTORANGED = 8
+
+
+class ScanData:
+    def __init__(self, wavelengths, x_steps, y_steps, monitor=False):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.x_steps = np.asarray(x_steps, dtype=float)
+        self.y_steps = np.asarray(y_steps, dtype=float)
+        self.values = VALUES + (MONITOR_VALUES if monitor else ())
+        dtype = ([(name, 'f8') for name in COORDINATES + self.values]
+                 + [('timestamp', 'f8'), ('sensitivity', 'f8'), ('flags', 'u1'), ('sequence', 'i4')])
+        self.records = np.empty((len(self.x_steps), len(self.y_steps), len(self.wavelengths)), dtype=dtype)
+        for name in self.values + ('timestamp', 'sensitivity'):
+            self.records[name] = np.nan
+        self.records['flags'] = 0
+        self.records['sequence'] = -1
+        # coordinates are set once for the whole scan by broadcasting the axes
+        self.records['x'] = self.x_steps[:, None, None]
+        self.records['y'] = self.y_steps[None, :, None]
+        self.records['wavelength'] = self.wavelengths[None, None, :]
+        self.count = 0  # number of points measured
+
+    @property
+    def shape(self):
+        return self.records.shape
+
+    def record(self, k, i, j, values, timestamp=np.nan, sensitivity=None, flags=0):
+        # Store the values of the point at wavelength index k and position (i, j), in the order of self.values
+        point = self.records[i, j, k]
+        for name, value in zip(self.values, values):
+            point[name] = value
+        point['timestamp'] = timestamp
+        point['sensitivity'] = np.nan if sensitivity is None else float(sensitivity)
+        point['flags'] = flags | MEASURED
+        point['sequence'] = self.count
+        self.count += 1
+
+    def field(self, name='signal'):
+        # Cube of one field shaped (x, y, wavelength), a view
+        return self.records[name]
+
+    def spectrum(self, i, j, name='signal'):
+        return self.records[name][i, j, :]
+
+    def wavelength_map(self, k, name='signal'):
+        return self.records[name][:, :, k]
+
+    def table(self):
+        # All points as a flat structured array, one row per point in (x, y, wavelength) order, a view
+        return self.records.reshape(-1)
+
+    def measured(self):
+        # Points measured so far, in the order they were measured
+        table = self.table()
+        rows = table[table['flags'] & MEASURED > 0]
+        return rows[np.argsort(rows['sequence'])]
+
+    def quantities(self):
+        # Cubes of the measured quantities for the result store, keyed by field name
+        return {name: self.records[name] for name in self.values}
+
+    def extras(self):
+        # Cubes of the other fields of each point (time, sensitivity and flags) for the result store, in their own dtype
+        return {name: self.records[name] for name in ('timestamp', 'sensitivity', 'flags')}
@@ -0,0 +1,235 @@
+"""
+Project: Grating Tester
+File: scanplan.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Scan planning for the grating tester.
+
+A scan plan is built from the wavelength, X and Y settings before a run starts. The plan holds the full list of
+points, is checked against the stage travel limits and the monochromator range configured for the rig (see rig.py),
+and predicts how long the run will take. The duration is predicted from a cost model (seconds per point, per
+wavelength change, per stage move), which is calibrated on the measured durations of previous runs. The lock-in
+settling wait of each point is known from the time constant and filter slope, so it is added as it is rather than
+fitted, and runs with different time constants calibrate the same costs.
+
+The monochromator changes grating and order sorting filter at fixed wavelengths, and each change is far slower than a
+normal move. When these switch-over wavelengths are configured for the rig, the wavelengths of a plan are grouped into
+the bands between them and the bands are visited in one sweep, starting from the band the monochromator is already in,
+so each change is made at most once. Without a switch-over table the wavelengths are measured in the order given.
+
+Dependencies:
+- numpy, scipy
+
+"""
+import json
+import os
+import numpy as np
+import scipy.optimize
+
+# cost model terms, with default costs (s) from the waits in the scan loop
+FEATURES = ('runs', 'points', 'wavelengths', 'switches', 'x_moves', 'y_moves', 'y_returns')
+DEFAULT_COSTS = {'runs': 5.0,       # start up, lock-in configuration and returning to the start
+                 'points': 6.0,     # fast buffer acquisition (500 points every 10 ms) and read out
+                 'wavelengths': 2.0,
+                 'switches': 20.0,  # monochromator grating or filter change
+                 'x_moves': 2.0,
+                 'y_moves': 1.0,
+                 'y_returns': 4.0}
+
+
+def parse_steps(size, number, axis):
+    # Stage positions (mm) for a step size and number of steps, a single position at 0 if there are no steps
+    if not str(number).strip():
+        return np.array([0.0])
+    try:
+        size = float(size)
+        number = float(number)
+    except ValueError:
+        raise ValueError(f"{axis} step size and number of steps must be numbers.")
+    if not number.is_integer() or number < 1:
+        raise ValueError(f"{axis} number of steps must be a whole number of at least 1.")
+    return np.arange(int(number)) * size
+
+
+def bands(wavelengths, switch_wavelengths=()):
+    # Index of the grating/filter band of each wavelength, switch_wavelengths are the wavelengths (nm) at which the
+    # monochromator changes grating or order sorting filter, all wavelengths are in band 0 if there are none
+    return np.searchsorted(switch_wavelengths, wavelengths, side='right')
+
+
+def order_wavelengths(wavelengths, switch_wavelengths=(), current=None):
+    # Order in which to measure the wavelengths (indices) so that the bands are visited in one sweep.
+    # The sweep starts from the band of the current wavelength, going first towards the nearer end of the plan,
+    # and within a band the wavelengths are measured in the direction of the sweep.
+    # Without a switch-over table the wavelengths are measured in the order given
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    if len(switch_wavelengths) == 0:
+        return np.arange(len(wavelengths))
+    band = bands(wavelengths, switch_wavelengths)
+    low, high = band.min(), band.max()
+    if current is None:
+        start = low
+    else:
+        start = min(max(int(bands(current, switch_wavelengths)), low), high)
+    down = [(b, False) for b in range(start, low - 1, -1)]
+    up = [(b, True) for b in range(start, high + 1)]
+    if start - low <= high - start:
+        # down to the lowest band first, then up through the rest
+        sequence = down + up[1:] if start > low else up
+    else:
+        sequence = up + down[1:] if start < high else down
+    order = []
+    for b, ascending in sequence:
+        indices = np.flatnonzero(band == b)
+        indices = indices[np.argsort(wavelengths[indices], kind='stable')]
+        order.extend(indices if ascending else indices[::-1])
+    return np.array(order, dtype=int)
+
+
+def count_switches(wavelengths, switch_wavelengths=()):
+    # Number of grating/filter changes when moving through the wavelengths in the order given
+    return int(np.count_nonzero(np.diff(bands(wavelengths, switch_wavelengths))))
+
+
+def format_duration(seconds):
+    hours, remainder = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours} h {minutes:02d} min"
+    return f"{minutes} min {seconds:02d} s"
+
+
+class ScanPlan:
+    def __init__(self, wavelengths, x_steps, y_steps, x_origin=0.0, y_origin=0.0,
+                 switch_wavelengths=(), current_wavelength=None, settle_accuracy=1e-3, settle_time=None):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.x_steps = np.asarray(x_steps, dtype=float)
+        self.y_steps = np.asarray(y_steps, dtype=float)
+        # stage positions (mm) that the steps are relative to
+        self.x_origin = x_origin
+        self.y_origin = y_origin
+        # wavelength indices in the order they are measured, grouped to minimise grating and filter changes
+        self.switch_wavelengths = switch_wavelengths
+        self.order = order_wavelengths(self.wavelengths, switch_wavelengths, current_wavelength)
+        # fraction of a step change that the lock-in output settles to before each point
+        self.settle_accuracy = settle_accuracy
+        # lock-in settling wait per point (s), None if the lock-in filter settings are not known
+        self.settle_time = settle_time
+
+    @classmethod
+    def from_entries(cls, wavelength_start, wavelength_stop, wavelength_step,
+                     x_step_size, x_step_number, y_step_size, y_step_number, x_origin=0.0, y_origin=0.0,
+                     switch_wavelengths=(), current_wavelength=None, settle_accuracy="0.001", settle_time=None):
+        # Build a plan from the text of the experiment settings, raises ValueError with a message for the user
+        try:
+            start, stop, step = float(wavelength_start), float(wavelength_stop), float(wavelength_step)
+        except ValueError:
+            raise ValueError("Wavelength start, stop and step must be numbers.")
+        if step <= 0:
+            raise ValueError("Wavelength step must be greater than zero.")
+        wavelengths = np.arange(start, stop, step)
+        if len(wavelengths) == 0:
+            raise ValueError("Wavelength stop must be greater than start.")
+        x_steps = parse_steps(x_step_size, x_step_number, "X")
+        y_steps = parse_steps(y_step_size, y_step_number, "Y")
+        try:
+            settle_accuracy = float(settle_accuracy)
+        except ValueError:
+            raise ValueError("Settling accuracy must be a number.")
+        if not 0 < settle_accuracy < 1:
+            raise ValueError("Settling accuracy must be a fraction greater than 0 and less than 1.")
+        return cls(wavelengths, x_steps, y_steps, x_origin, y_origin, switch_wavelengths, current_wavelength,
+                   settle_accuracy, settle_time)
+
+    def __len__(self):
+        return len(self.wavelengths) * len(self.x_steps) * len(self.y_steps)
+
+    def points(self):
+        # (k, i, j) indices of the points in the order they are measured, wavelength is the outer loop
+        for k in self.order:
+            for i in range(len(self.x_steps)):
+                for j in range(len(self.y_steps)):
+                    yield k, i, j
+
+    def validate(self, travel_limits=None, wavelength_range=None):
+        # List of problems with the plan, empty if it can be run. travel_limits (mm, relative to the controller zero)
+        # and wavelength_range (nm) are (low, high) limits of the rig, limits that are None are not checked
+        problems = []
+        for axis, origin, steps in (("X", self.x_origin, self.x_steps), ("Y", self.y_origin, self.y_steps)):
+            low, high = origin + steps.min(), origin + steps.max()
+            if travel_limits is not None and (low < travel_limits[0] or high > travel_limits[1]):
+                problems.append(f"{axis} positions {low:g} to {high:g} mm are outside the stage travel "
+                                f"{travel_limits[0]:g} to {travel_limits[1]:g} mm.")
+        low, high = self.wavelengths.min(), self.wavelengths.max()
+        if wavelength_range is not None and (low < wavelength_range[0] or high > wavelength_range[1]):
+            problems.append(f"Wavelengths {low:g} to {high:g} nm are outside the monochromator range "
+                            f"{wavelength_range[0]:g} to {wavelength_range[1]:g} nm.")
+        return problems
+
+    def features(self):
+        # Number of each type of operation in the run, as used by the cost model
+        nx, ny, nw = len(self.x_steps), len(self.y_steps), len(self.wavelengths)
+        x_moves = 0
+        y_returns = 0
+        x, y = 0.0, 0.0
+        for k in range(nw):
+            for i in range(nx):
+                if y != self.y_steps[0]:
+                    y_returns += 1
+                if x != self.x_steps[i]:
+                    x_moves += 1
+                x, y = self.x_steps[i], self.y_steps[-1]
+        # return to the start at the end of the run
+        x_moves += x != 0.0
+        y_returns += y != 0.0
+        y_moves = nw * nx * int(np.count_nonzero(np.diff(self.y_steps)))
+        switches = count_switches(self.wavelengths[self.order], self.switch_wavelengths)
+        # time spent waiting for the lock-in to settle (s), a known cost
+        settling = len(self) * self.settle_time if self.settle_time else 0.0
+        return {'runs': 1, 'points': len(self), 'wavelengths': nw, 'switches': switches,
+                'x_moves': int(x_moves), 'y_moves': y_moves, 'y_returns': int(y_returns), 'settling': settling}
+
+
+class CostModel:
+    def __init__(self, path=None):
+        # path of the json file holding the timings of previous runs
+        self.path = path
+        self.runs = []
+        self.costs = dict(DEFAULT_COSTS)
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.runs = json.load(f)
+        self.calibrate()
+
+    def estimate(self, plan):
+        # Predicted duration of a plan (s)
+        features = plan.features()
+        return sum(self.costs[name] * features[name] for name in FEATURES) + features['settling']
+
+    def record(self, plan, duration):
+        # Add the measured duration of a run and recalibrate
+        self.runs.append({'features': plan.features(), 'duration': duration})
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(self.runs, f, indent=1)
+        self.calibrate()
+
+    def calibrate(self):
+        self.costs = dict(DEFAULT_COSTS)
+        if not self.runs:
+            return
+        a = np.array([[run['features'].get(name, 0) for name in FEATURES] for run in self.runs], dtype=float)
+        # the costs are fitted to the time not spent settling
+        b = np.array([run['duration'] - run['features'].get('settling', 0) for run in self.runs], dtype=float)
+        if len(self.runs) >= 2 * len(FEATURES):
+            # enough runs to fit every cost, costs cannot be negative
+            costs, _ = scipy.optimize.nnls(a, b)
+            if np.all(a @ costs > 0):
+                self.costs = dict(zip(FEATURES, costs.tolist()))
+                return
+        # otherwise scale the default costs to match the previous runs
+        predicted = a @ np.array([DEFAULT_COSTS[name] for name in FEATURES])
+        scale = float(np.median(b / predicted))
+        self.costs = {name: cost * scale for name, cost in DEFAULT_COSTS.items()}
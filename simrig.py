@@ -0,0 +1,202 @@
+"""
+Project: Grating Tester
+File: simrig.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Simulated test rig.
+
+The simulated instruments answer the same commands as the real ones (the Newmark serial protocol, the Bentham
+commands, the SR7230 attributes used by lockincontrol and the thorlabs_apt Motor interface), so a simulated rig runs
+the real drivers and the real scan engine. The lock-in reads a model grating: a Gaussian efficiency curve in
+wavelength with a small tilt across the aperture, plus noise. Waits are scaled by time_scale (0 runs as fast as
+possible) and a fault can be injected after a number of lock-in readings to test how failures are handled.
+
+Usage:
+    rig = SimulatedRig("Bench 1", peak_wavelength=1200, time_scale=0)
+    rig.run_scan(job)
+
+"""
+import time
+import numpy as np
+
+from rig import Rig
+from lockincontrol import FULL_SCALE
+
+# SR7230 voltage sensitivities (V), 2 nV to 1 V in a 1-2-5 sequence
+SENSITIVITIES = tuple(float(f"{mantissa}e{exponent}") for exponent in range(-9, 1) for mantissa in (1, 2, 5)
+                      if 2e-9 <= mantissa * 10.0 ** exponent <= 1)
+
+
+class SimulatedBench:
+    # Shared state of the simulated instruments of one rig and the model of the grating under test
+    def __init__(self, x_port='COM4', y_port='COM5', peak_wavelength=1000.0, width=200.0, peak_signal=2e-3,
+                 noise=0.002, tilt=0.001, fail_after=None, seed=None):
+        self.ports = {x_port: 'x', y_port: 'y'}
+        self.positions = {'x': 0.0, 'y': 0.0}   # stage positions (steps)
+        self.wavelength = 500.0
+        self.angles = {}    # rotation stage serial number -> position (stage units)
+        self.peak_wavelength = peak_wavelength
+        self.width = width
+        self.peak_signal = peak_signal  # lock-in input at the peak (V)
+        self.noise = noise  # relative noise of each sample
+        self.tilt = tilt    # relative change of the signal per step across the aperture
+        self.fail_after = fail_after    # lock-in readings before the lock-in stops responding, None never fails
+        self.readings = 0
+        self.random = np.random.default_rng(seed)
+
+    def signal(self):
+        # Lock-in input (V) at the current wavelength and position
+        efficiency = np.exp(-0.5 * ((self.wavelength - self.peak_wavelength) / self.width) ** 2)
+        return self.peak_signal * efficiency * (1 + self.tilt * (self.positions['x'] + self.positions['y']))
+
+
+class SimulatedSerial:
+    # Newmark stage controller on a serial port
+    def __init__(self, bench, port, baudrate=9600, timeout=1):
+        self.bench = bench
+        self.axis = bench.ports[port]
+        self.open = True
+        self.replies = []
+
+    def isOpen(self):
+        return self.open
+
+    def close(self):
+        self.open = False
+
+    def reset_input_buffer(self):
+        self.replies = []
+
+    def write(self, data):
+        command = data.decode().strip()
+        if command.startswith('MA '):
+            self.bench.positions[self.axis] = float(command[3:])
+        elif command == 'P=0':
+            self.bench.positions[self.axis] = 0.0
+        elif command == 'P':
+            self.replies.append(f"P={self.bench.positions[self.axis]:g}\r\n".encode())
+        return len(data)
+
+    def readline(self):
+        return self.replies.pop(0) if self.replies else b""
+
+
+class SimulatedMonochromator:
+    # Bentham monochromator
+    def __init__(self, bench):
+        self.bench = bench
+
+    def query(self, command):
+        if command == "*IDN?":
+            return "Bentham Instruments,Simulated monochromator,0,1.0"
+        if command.startswith("MONO:GOTO?"):
+            self.bench.wavelength = float(command.split()[-1])
+            return "0"
+        return ""
+
+    def write(self, command):
+        return None
+
+
+class SimulatedFastBuffer:
+    def __init__(self, lockin):
+        self.lockin = lockin
+        self.enabled = False
+        self.storage_interval = 10000
+        self.length = 500
+
+    def __getitem__(self, curve):
+        return list(self.lockin.curves.get(curve, ()))
+
+
+class SimulatedSR7230:
+    # SR7230 lock-in amplifier, with the attributes used by lockincontrol
+    def __init__(self, bench, address):
+        self.bench = bench
+        self.address = address
+        self.fast_buffer = SimulatedFastBuffer(self)
+        self.time_constant = 0.01
+        self.slope = '24 dB'
+        self.sensitivity = 1e-3
+        self.acquisition_status = ('off',)
+        self.curves = {}
+
+    def check(self):
+        bench = self.bench
+        if bench.fail_after is not None and bench.readings >= bench.fail_after:
+            raise ConnectionError(f"Simulated lock-in at {self.address[0]} not responding")
+
+    @property
+    def x(self):
+        self.check()
+        return self.bench.signal()
+
+    def auto_sensitivity(self):
+        # smallest sensitivity that holds the signal at under 80 % of full scale
+        signal = abs(self.bench.signal())
+        self.sensitivity = next((value for value in SENSITIVITIES if signal < 0.8 * value), SENSITIVITIES[-1])
+
+    def take_data(self):
+        self.check()
+        self.bench.readings += 1
+        length = int(self.fast_buffer.length)
+        signal = self.bench.signal() * (1 + self.bench.noise * self.bench.random.standard_normal(length))
+        self.curves['x'] = np.clip(signal / float(self.sensitivity) * FULL_SCALE, -FULL_SCALE, FULL_SCALE)
+        # the monitor detector sees the lamp without the grating
+        self.curves['adc2'] = 1 + self.bench.noise * self.bench.random.standard_normal(length)
+        self.acquisition_status = ('off',)
+
+
+class SimulatedMotor:
+    def __init__(self, bench, serial_number):
+        self.bench = bench
+        self.serial_number = serial_number
+        bench.angles.setdefault(serial_number, 0.0)
+        self.is_in_motion = False
+
+    @property
+    def position(self):
+        return self.bench.angles[self.serial_number]
+
+    def move_to(self, value, blocking=False):
+        self.bench.angles[self.serial_number] = float(value)
+
+    def move_by(self, value, blocking=False):
+        self.bench.angles[self.serial_number] += float(value)
+
+    def move_home(self, blocking=False):
+        self.bench.angles[self.serial_number] = 0.0
+
+
+class SimulatedAPT:
+    # thorlabs_apt module with two NR360S rotation stages
+    def __init__(self, bench, serial_numbers=(90000001, 90000002)):
+        self.bench = bench
+        self.serial_numbers = serial_numbers
+
+    def list_available_devices(self):
+        return [(31, serial_number) for serial_number in self.serial_numbers]
+
+    def Motor(self, serial_number):
+        return SimulatedMotor(self.bench, serial_number)
+
+
+class SimulatedRig(Rig):
+    def __init__(self, name=None, time_scale=0.0, peak_wavelength=1000.0, fail_after=None, seed=None, **settings):
+        # time_scale is the fraction of the real waits that are slept, the other settings are those of Rig
+        self.time_scale = time_scale
+        self.bench = SimulatedBench(settings.get('x_port', 'COM4'), settings.get('y_port', 'COM5'),
+                                    peak_wavelength=peak_wavelength, fail_after=fail_after, seed=seed)
+        bench = self.bench
+        # the simulated APT library lists the rotation stages of the rig, or two default ones
+        apt = SimulatedAPT(bench, settings['rotation_serials']) if settings.get('rotation_serials') else SimulatedAPT(bench)
+        super().__init__(name, open_port=lambda port, **options: SimulatedSerial(bench, port, **options),
+                         open_monochromator=lambda: SimulatedMonochromator(bench),
+                         open_lockin=lambda address: SimulatedSR7230(bench, address),
+                         apt=apt, sleep=self.scaled_sleep, **settings)
+
+    def scaled_sleep(self, seconds):
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
@@ -0,0 +1,193 @@
+"""
+Project: Grating Tester
+File: stagecontrol.py
+Author: David Gooding
+Version: 1.0
+Date: 19/10/2026
+
+Stage drivers for the grating tester.
+
+The Newmark NLS4 translation stages are driven over a serial port that is opened once and kept open. Each stage keeps
+a cached model of its position (the last commanded position and the last position read back from the controller), so
+moves are sent as absolute 'MA' commands computed from the cache and moves to the current position are skipped. The
+position is only read back from the controller at checkpoints (on connection, at the start of each wavelength and at
+the end of a run), which stops errors from relative moves accumulating over a scan.
+
+The Thorlabs NR360S rotation stages are enumerated once over USB and their APT Motor objects are kept, keyed by serial
+number. The devices are only re-enumerated on an error or an explicit refresh. The stages are chosen by serial number
+when several are connected to the computer, otherwise the first two devices found are used.
+
+Dependencies:
+- pyserial: serial communication with the Newmark stage controllers (imported on first connection)
+- thorlabs_apt: Thorlabs APT rotation stages (imported on first use as it loads the APT library)
+
+"""
+
+
+def open_serial(port, **options):
+    import serial   # Newmark stages
+    return serial.Serial(port, **options)
+
+
+class TranslationStage:
+    # positions within this many controller steps are treated as the same position
+    tolerance = 1e-6
+
+    def __init__(self, port, steps_per_mm=8.0645, baudrate=9600, timeout=1, open_port=None):
+        self.port = port
+        # opens the serial port, replaced to run against a simulated controller
+        self.open_port = open_port or open_serial
+        # conversion factor determined experimentally and verified as step size from the manual
+        self.steps_per_mm = steps_per_mm
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.ser = None
+        self.commanded = 0.0    # last position sent to the controller (steps)
+        self.confirmed = None   # last position read back from the controller (steps)
+
+    def connect(self):
+        # Open the serial port once and synchronise the cached position with the controller
+        if self.ser is None or not self.ser.isOpen():
+            self.ser = self.open_port(self.port, baudrate=self.baudrate, timeout=self.timeout)
+            self.read_position()
+        return self.ser
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+        self.ser = None
+
+    def write(self, command):
+        self.connect().write(command.encode() + b'\r\n')
+
+    def reset_input_buffer(self):
+        self.connect().reset_input_buffer()
+
+    def to_steps(self, mm):
+        # Convert a distance in mm to controller steps with the calibrated steps per mm, if zero return zero
+        if mm == 0:
+            return 0.0
+        return float(mm) * self.steps_per_mm
+
+    def position(self):
+        # Current position in mm according to the cached model
+        return self.commanded / self.steps_per_mm
+
+    def move_to(self, mm):
+        # Absolute move computed from the cached position, returns the distance moved in mm (0 if skipped)
+        target = self.to_steps(mm)
+        distance = abs(target - self.commanded)
+        if distance <= self.tolerance:
+            return 0.0
+        self.write('MA ' + str(target))
+        self.commanded = target
+        return distance / self.steps_per_mm
+
+    def move_by(self, mm):
+        # Relative moves are made absolute from the cached position so that they cannot drift
+        return self.move_to(self.position() + float(mm))
+
+    def zero(self):
+        self.write('P=0')
+        self.commanded = 0.0
+        self.confirmed = 0.0
+
+    def read_position(self):
+        # Read the position back from the controller, returns None if there is no valid reply
+        self.reset_input_buffer()
+        self.write('P')
+        reply = self.ser.readline().decode(errors='ignore').strip()
+        try:
+            position = float(reply.split()[-1].split('=')[-1])
+        except (IndexError, ValueError):
+            return None
+        self.confirmed = position
+        self.commanded = position
+        return position
+
+    def checkpoint(self):
+        # Confirm the cached position against the controller, returns the drift in mm (None if not read back)
+        expected = self.commanded
+        position = self.read_position()
+        if position is None:
+            return None
+        return (position - expected) / self.steps_per_mm
+
+
+class RotationStages:
+    def __init__(self, degrees_per_unit=5.5, apt=None, serial_numbers=None):
+        # stage units are converted to degrees by this factor
+        self.degrees_per_unit = degrees_per_unit
+        # APT library module, imported on first use unless one is given (e.g. a simulated one)
+        self.apt = apt
+        # serial numbers of rotation 1 and 2, None to use the devices in enumeration order
+        self.serial_numbers = None if serial_numbers is None else [int(number) for number in serial_numbers]
+        self.serials = []   # serial numbers in enumeration order
+        self.motors = {}    # serial number -> apt.Motor
+
+    def library(self):
+        if self.apt is None:
+            import thorlabs_apt as apt  # Thorlabs stages
+            self.apt = apt
+        return self.apt
+
+    def refresh(self):
+        # Enumerate the APT devices and drop the Motor objects of devices that have gone
+        devices = self.library().list_available_devices()
+        self.serials = [device[1] for device in devices]
+        self.motors = {serial_number: motor for serial_number, motor in self.motors.items()
+                       if serial_number in self.serials}
+        return self.serials
+
+    def find(self, index):
+        # Serial number of rotation stage number index + 1 among the devices found, None if it was not found
+        if self.serial_numbers is None:
+            return self.serials[index] if index < len(self.serials) else None
+        if index < len(self.serial_numbers) and self.serial_numbers[index] in self.serials:
+            return self.serial_numbers[index]
+        return None
+
+    def motor(self, index):
+        # Motor object for rotation stage number index + 1, enumerating the devices on first use
+        serial_number = self.find(index)
+        if serial_number is None:
+            self.refresh()
+            serial_number = self.find(index)
+        if serial_number is None:
+            if self.serial_numbers is None:
+                raise IndexError(f"Rotation stage {index + 1} not found, {len(self.serials)} APT devices available")
+            raise IndexError(f"Rotation stage {index + 1} not found, APT devices available: {self.serials}")
+        if serial_number not in self.motors:
+            self.motors[serial_number] = self.library().Motor(serial_number)
+        return self.motors[serial_number]
+
+    def call(self, index, action):
+        # Run an action on a motor, re-enumerating the devices and retrying once if it fails
+        try:
+            return action(self.motor(index))
+        except IndexError:
+            raise
+        except Exception:
+            # the Motor object may have gone stale (e.g. the stage was reconnected), open a new one for the retry
+            self.motors.pop(self.find(index), None)
+            self.refresh()
+            return action(self.motor(index))
+
+    def serial_number(self, index):
+        self.motor(index)
+        return self.find(index)
+
+    def move_to(self, index, degrees, blocking=False):
+        return self.call(index, lambda motor: motor.move_to(degrees / self.degrees_per_unit, blocking))
+
+    def move_by(self, index, degrees, blocking=False):
+        return self.call(index, lambda motor: motor.move_by(degrees / self.degrees_per_unit, blocking))
+
+    def home(self, index, blocking=False):
+        return self.call(index, lambda motor: motor.move_home(blocking))
+
+    def is_moving(self, index):
+        return self.call(index, lambda motor: motor.is_in_motion)
+
+    def position(self, index):
+        return self.call(index, lambda motor: motor.position * self.degrees_per_unit)
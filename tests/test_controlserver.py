@@ -0,0 +1,127 @@
+import socket
+import time
+
+import pytest
+
+from controlserver import ControlServer, ControlClient
+from jobqueue import JobQueue
+from orchestrator import Orchestrator
+from simrig import SimulatedRig
+
+
+@pytest.fixture
+def server():
+    rig = SimulatedRig("Bench 1", seed=1)
+    server = ControlServer(rig, JobQueue(None), port=0, queue_length=10)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    client = ControlClient(*server.server.server_address, timeout=10)
+    yield client
+    client.close()
+
+
+def test_commands(client):
+    assert client.call("move", axis="x", position=2.5) == 2.5
+    assert client.call("set_wavelength", wavelength=850) == 850
+    assert client.call("position") == {'x': 2.5, 'y': 0.0, 'wavelength': 850.0}
+    assert client.call("status")['pending'] == 0
+    with pytest.raises(RuntimeError, match="Unknown command"):
+        client.call("fly")
+    with pytest.raises(RuntimeError, match="Unknown axis"):
+        client.call("move", axis="z", position=1)
+
+
+def test_subscribe_events(server, client):
+    client.subscribe()
+    server.broadcast('point', wavelength=850, values=[1.0, 0.1])
+    event = client.next_event()
+    assert event == {'event': 'point', 'wavelength': 850, 'values': [1.0, 0.1]}
+
+
+def test_client_that_stops_reading_does_not_block_events(server, client):
+    # a subscriber that never reads its events
+    idle = socket.create_connection(server.server.server_address)
+    idle.sendall(b'{"id": 1, "command": "subscribe"}\n')
+    while not server.subscribers:
+        time.sleep(0.01)
+    start = time.time()
+    for index in range(2000):
+        server.broadcast('message', text="x" * 10000, index=index)
+    assert time.time() - start < 5
+    # the idle client is dropped once its queue is full, the other clients are still served
+    assert not server.subscribers
+    client.subscribe()
+    server.broadcast('message', text="still here")
+    assert client.next_event()['text'] == "still here"
+    idle.close()
+
+
+def follow_scan(client, job_id):
+    # Points and messages streamed by a scan until its results have been saved
+    points, messages = [], []
+    while not any(message.startswith("Cube saved") for message in messages):
+        event = client.next_event()
+        if event['event'] == 'point':
+            assert event['job_id'] == job_id
+            points.append(event)
+        elif event['event'] == 'message':
+            messages.append(event['text'])
+    return points, messages
+
+
+def test_scan_streamed_to_subscribers(server, client, tmp_path):
+    client.subscribe()
+    job_id = client.call("submit_scan", settings={'wavelength_start': "800", 'wavelength_stop': "1000",
+                                                  'wavelength_step': "100", 'x_step_size': "1", 'x_step_number': "2",
+                                                  'root_folder': str(tmp_path), 'file_name': "remote"})
+    points, messages = follow_scan(client, job_id)
+    assert [(point['wavelength'], point['x']) for point in points] == [(800, 0), (800, 1), (900, 0), (900, 1)]
+    assert len(points[0]['values']) == 2
+
+
+def test_orchestrator_rig_server(tmp_path):
+    orchestrator = Orchestrator([SimulatedRig("A", seed=1), SimulatedRig("B", seed=2)], echo=False)
+    server = orchestrator.control_server("B", port=0)
+    server.start()
+    client = ControlClient(*server.server.server_address, timeout=10)
+    try:
+        client.subscribe()
+        client.call("move", axis="y", position=1.5)
+        job_id = client.call("submit_scan", settings={'wavelength_start': "800", 'wavelength_stop': "900",
+                                                      'wavelength_step': "50", 'root_folder': str(tmp_path),
+                                                      'file_name': "remote"})
+        assert orchestrator.wait(timeout=60)
+        assert [job['status'] for job in client.call("queue")] == ['done']
+        assert orchestrator.queues['B'].jobs[0].job_id == job_id and not orchestrator.queues['A'].jobs
+        assert orchestrator.rigs['B'].y_stage.position() == pytest.approx(1.5, abs=1e-4)
+        # the scan is streamed to the subscribed client
+        points, messages = follow_scan(client, job_id)
+        assert [point['wavelength'] for point in points] == [800, 850]
+        assert any(message.startswith("Cube saved") for message in messages)
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_reply_sent_before_a_half_closed_client_is_closed(server):
+    # clients that send one request and close their side (e.g. echo ... | nc) still get the reply
+    def request():
+        connection = socket.create_connection(server.server.server_address, timeout=10)
+        connection.sendall(b'{"id": 1, "command": "position"}\n')
+        connection.shutdown(socket.SHUT_WR)
+        reply = b""
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            reply += data
+        connection.close()
+        return reply
+
+    replies = [request() for _ in range(50)]
+    assert all(reply.startswith(b'{"id": 1, "result"') for reply in replies)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from csvloader import convert_csv, load_csv, to_cube
+from resultstore import ResultCube
+from simrig import SimulatedRig
+from test_simrig import make_job
+
+TABLE = np.array([[800, 0, 0, 1.5, 0.1],
+                  [800, 0, 1, 2.5, 0.2],
+                  [900, 0, 0, 3.5, 0.3],
+                  [0, 0, 0, 0, 0]])     # preallocated row of a point that was not measured
+SAVETXT_HEADER = "Wavelength (nm), X Step (mm), Y Step (mm), Signal (V), Signal Std (V)"
+
+
+def test_savetxt_with_comment_header(tmp_path):
+    path = tmp_path / "20200101-120000_old.csv"
+    np.savetxt(path, TABLE, delimiter=",", header=SAVETXT_HEADER)
+    assert path.read_text().startswith("# ")
+    columns = load_csv(str(path))
+    assert list(columns) == ['wavelength', 'x', 'y', 'signal', 'signal_std']
+    assert np.array_equal(columns['signal'], [1.5, 2.5, 3.5])
+
+
+def test_save_data_csv_header(tmp_path):
+    path = tmp_path / "20210101-120000_old.csv"
+    np.savetxt(path, TABLE, delimiter=",", header=SAVETXT_HEADER, comments='')
+    columns = load_csv(str(path))
+    assert np.array_equal(columns['wavelength'], [800, 800, 900])
+    assert np.array_equal(columns['signal_std'], [0.1, 0.2, 0.3])
+
+
+def test_crlf_and_truncated_last_row(tmp_path):
+    path = tmp_path / "20220101-120000_stopped.csv"
+    text = ("Wavelength (nm),X step (mm),Y step (mm),Signal (mV),Signal std (mV),"
+            "Monitor,Monitor std,Ratio,Ratio std\r\n"
+            "800.0, 0.0, 0.0, 1.5, 0.1, 1.0, 0.01, 1.5, 0.1\r\n"
+            "800.0, 0.0, 1.0, 2.5, 0.2, 1.0, 0.01, 2.5, 0.2\r\n"
+            "900.0, 0.0, 0.0, 3.5")
+    path.write_bytes(text.encode())
+    columns = load_csv(str(path))
+    assert list(columns)[-2:] == ['ratio', 'ratio_std']
+    assert np.array_equal(columns['y'], [0, 1])
+    assert np.array_equal(columns['ratio'], [1.5, 2.5])
+
+
+def test_points_not_measured_are_nan():
+    columns = {'wavelength': np.array([800.0, 800.0, 900.0]), 'x': np.array([0.0, 0.0, 0.0]),
+               'y': np.array([0.0, 1.0, 0.0]), 'signal': np.array([1.5, 2.5, 3.5])}
+    wavelengths, x_steps, y_steps, cubes = to_cube(columns)
+    assert list(wavelengths) == [800, 900] and list(x_steps) == [0] and list(y_steps) == [0, 1]
+    assert cubes['signal'].shape == (1, 2, 2)
+    assert cubes['signal'][0, 0, 0] == 1.5 and cubes['signal'][0, 0, 1] == 3.5
+    assert np.isnan(cubes['signal'][0, 1, 1])
+
+
+def test_round_trip_of_a_scan(tmp_path):
+    rig = SimulatedRig("Bench 1", seed=1)
+    result = rig.run_scan(make_job(tmp_path, monitor_channel="Second lock-in", monitor_address="169.254.150.232"),
+                          output=lambda message: None)
+    data = result['data']
+    wavelengths, x_steps, y_steps, cubes = to_cube(load_csv(result['filename']))
+    assert np.array_equal(wavelengths, result['wavelengths'])
+    assert np.array_equal(x_steps, result['x_steps']) and np.array_equal(y_steps, result['y_steps'])
+    assert set(cubes) == set(data.values)
+    for name in data.values:
+        assert np.array_equal(cubes[name], data.field(name))
+    # the cube converted from the CSV matches the cube saved with the scan
+    converted = ResultCube(convert_csv(result['filename'], overwrite=True))
+    assert np.array_equal(converted.data('signal'), data.field('signal'))
@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+import pytest
+
+from iorecord import Replay, ReplayMismatch, replay_rig
+from jobqueue import ScanJob
+from simrig import SimulatedRig
+
+
+def record_scan(folder, **settings):
+    rig = SimulatedRig("Bench 1", seed=1)
+    job = ScanJob({'wavelength_start': "800", 'wavelength_stop': "1100", 'wavelength_step': "100",
+                   'x_step_size': "1", 'x_step_number': "2", 'root_folder': str(folder), 'file_name': "scan",
+                   'record_io': 1, **settings})
+    result = rig.run_scan(job, output=lambda message: None)
+    path, = folder.glob("*.io.jsonl")
+    return result, path
+
+
+@pytest.mark.parametrize('strict', [True, False])
+@pytest.mark.parametrize('monitor', ["None", "Second lock-in"])
+def test_record_and_replay(tmp_path, strict, monitor):
+    (tmp_path / "run").mkdir()
+    result, path = record_scan(tmp_path / "run", monitor_channel=monitor)
+    (tmp_path / "replay").mkdir()
+    rig, replay = replay_rig(str(path), strict=strict)
+    replayed = rig.run_scan(replay.job(str(tmp_path / "replay")), output=lambda message: None)
+    assert np.array_equal(replayed['data'].field('signal'), result['data'].field('signal'))
+    report = replay.report()
+    assert report['remaining'] == {} and report['skipped'] == 0
+    # the replay is deterministic, it is run in a new folder so that it starts from the same gain map
+    (tmp_path / "again").mkdir()
+    rig, again = replay_rig(str(path), strict=strict)
+    rig.run_scan(again.job(str(tmp_path / "again")), output=lambda message: None)
+    assert again.report()['replayed_duration'] == report['replayed_duration']
+
+
+def test_changed_job_does_not_match(tmp_path):
+    (tmp_path / "run").mkdir()
+    result, path = record_scan(tmp_path / "run")
+    rig, replay = replay_rig(str(path))
+    with pytest.raises(ReplayMismatch):
+        rig.run_scan(replay.job(str(tmp_path), wavelength_start="850"), output=lambda message: None)
+
+
+def test_overlapping_io_is_not_added_twice(tmp_path):
+    # two instruments used at the same time in the recording, replayed in either order
+    path = tmp_path / "overlap.io.jsonl"
+    events = [{'op': 'start', 'time': 0},
+              {'t': 0.0, 'dt': 1.0, 'device': 'a', 'op': 'call', 'name': 'move', 'args': [], 'result': None},
+              {'t': 0.5, 'dt': 1.0, 'device': 'b', 'op': 'call', 'name': 'read', 'args': [], 'result': 2},
+              {'t': 1.5, 'dt': 0.5, 'device': 'rig', 'op': 'sleep'}]
+    path.write_text("".join(json.dumps(event) + "\n" for event in events))
+    for order in (('a', 'b'), ('b', 'a')):
+        replay = Replay(str(path))
+        for device in order:
+            replay.answer(device, 'call', 'move' if device == 'a' else 'read', [])
+        replay.sleep(0.5)
+        # a wait that was not recorded adds its full length
+        replay.sleep(0.25)
+        assert replay.clock() == pytest.approx(2.25)
+        assert replay.report()['io_time'] == pytest.approx(2.0)
@@ -0,0 +1,118 @@
+import time
+from threading import Event
+
+from jobqueue import JobQueue, ScanJob
+
+
+class FakeScan:
+    # run_job for the queue: waits at a gate, then measures a few points calling checkpoint() before each one
+    def __init__(self, queue, points=3):
+        self.queue = queue
+        self.points = points
+        self.gate = Event()
+        self.gate.set()
+        self.running = Event()
+        self.measured = []  # (file name, point)
+
+    def __call__(self, job):
+        self.running.set()
+        self.gate.wait()
+        for point in range(self.points):
+            self.queue.checkpoint()
+            self.measured.append((job['file_name'], point))
+
+    def hold(self):
+        # Stop the next job at the gate until release(), running is set when it gets there
+        self.gate.clear()
+        self.running.clear()
+
+    def release(self):
+        self.gate.set()
+
+
+def make_queue(tmp_path, names=("a", "b")):
+    queue = JobQueue(str(tmp_path / "scan_queue.json"))
+    for name in names:
+        queue.add(ScanJob({'file_name': name}))
+    return queue
+
+
+def finish(queue):
+    queue.worker.join(timeout=10)
+    assert not queue.is_running()
+    return [job.status for job in queue.jobs]
+
+
+def test_jobs_run_in_order(tmp_path):
+    queue = make_queue(tmp_path)
+    scan = FakeScan(queue)
+    queue.start(scan)
+    assert finish(queue) == ['done', 'done']
+    assert [name for name, _ in scan.measured] == ["a"] * 3 + ["b"] * 3
+
+
+def test_pause_and_resume(tmp_path):
+    queue = make_queue(tmp_path)
+    scan = FakeScan(queue)
+    scan.hold()
+    queue.start(scan)
+    assert scan.running.wait(10)
+    queue.pause()
+    scan.release()
+    # the running job waits at its next checkpoint
+    time.sleep(0.2)
+    assert scan.measured == [] and queue.is_paused()
+    queue.resume()
+    assert finish(queue) == ['done', 'done']
+    assert len(scan.measured) == 6
+
+
+def test_skip_running_job(tmp_path):
+    queue = make_queue(tmp_path)
+    scan = FakeScan(queue)
+    scan.hold()
+    queue.start(scan)
+    assert scan.running.wait(10)
+    queue.skip()
+    scan.release()
+    assert finish(queue) == ['skipped', 'done']
+    assert [name for name, _ in scan.measured] == ["b"] * 3
+
+
+def test_skip_while_idle_does_not_stop_the_next_job(tmp_path):
+    queue = make_queue(tmp_path, ("a",))
+    queue.skip()
+    scan = FakeScan(queue)
+    queue.start(scan)
+    assert finish(queue) == ['done']
+    # a scan run outside the queue clears the skip before it starts in the same way
+    queue.skip()
+    queue.clear_skip()
+    queue.checkpoint()
+
+
+def test_running_job_can_be_moved_but_not_removed(tmp_path):
+    queue = make_queue(tmp_path)
+    scan = FakeScan(queue)
+    scan.hold()
+    queue.start(scan)
+    assert scan.running.wait(10)
+    running = queue.current
+    assert not queue.remove(running.job_id)
+    assert queue.move(running.job_id, 1)
+    assert [job['file_name'] for job in queue.jobs] == ["b", "a"]
+    scan.release()
+    assert finish(queue) == ['done', 'done']
+    # the moved job is not run a second time
+    assert [name for name, _ in scan.measured] == ["a"] * 3 + ["b"] * 3
+    assert queue.remove(running.job_id)
+
+
+def test_job_running_when_saved_is_queued_again(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.jobs[0].status = 'running'
+    queue.jobs[1].status = 'done'
+    queue.save()
+    reloaded = JobQueue(str(tmp_path / "scan_queue.json"))
+    assert [job.status for job in reloaded.jobs] == ['queued', 'done']
+    assert [job.job_id for job in reloaded.pending()] == [queue.jobs[0].job_id]
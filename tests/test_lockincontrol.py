@@ -0,0 +1,86 @@
+import pytest
+
+from lockincontrol import LockIn, settling_factor, slope_db
+from simrig import SimulatedBench, SimulatedSR7230
+
+
+@pytest.mark.parametrize('slope', ['24dB', '24 dB', ' 24 dB/octave', 24, 24.0])
+def test_slope_forms(slope):
+    assert slope_db(slope) == 24
+
+
+def test_unknown_slope():
+    with pytest.raises(ValueError):
+        slope_db('steep')
+
+
+def test_settling_factor():
+    # a single RC stage settles to 0.1 % in ln(1000) time constants
+    assert settling_factor('6dB') == pytest.approx(6.908, abs=2e-3)
+    assert settling_factor('12dB') == settling_factor('12 dB') > settling_factor('6dB')
+
+
+def test_unknown_sensitivity_is_not_scaled_as_one():
+    lockin = LockIn(open_device=lambda address: SimulatedSR7230(SimulatedBench(), address))
+    lockin.prepare_run()
+    assert lockin.sensitivity_scale() == 1.0
+    lockin.disconnect()
+    with pytest.raises(RuntimeError):
+        lockin.sensitivity_scale()
+    lockin.read_sensitivity()
+    assert lockin.sensitivity_scale() == 1.0
+
+
+class Recorded:
+    # Simulated lock-in (or one of its parts) that records the settings written to it and can fail some of them
+    def __init__(self, target, log, fail=(), prefix=""):
+        self.__dict__.update(target=target, log=log, fail=fail, prefix=prefix)
+
+    def __getattr__(self, name):
+        value = getattr(self.target, name)
+        if name == 'fast_buffer':
+            return Recorded(value, self.log, self.fail, "fast_buffer.")
+        return value
+
+    def __getitem__(self, curve):
+        return self.target[curve]
+
+    def __setattr__(self, name, value):
+        if self.prefix + name in self.fail:
+            raise ConnectionError("Simulated lock-in not responding")
+        self.log.append(self.prefix + name)
+        setattr(self.target, name, value)
+
+
+def recorded_lockin(fail=()):
+    bench, log = SimulatedBench(), []
+    lockin = LockIn(open_device=lambda address: Recorded(SimulatedSR7230(bench, address), log, fail))
+    return lockin, log
+
+
+def test_configure_sends_only_changed_settings():
+    lockin, log = recorded_lockin()
+    lockin.prepare_run()
+    assert sorted(log) == ['fast_buffer.enabled', 'fast_buffer.length', 'fast_buffer.storage_interval']
+    del log[:]
+    lockin.prepare_run()
+    lockin.acquire()
+    assert lockin.set_sensitivity(lockin.settings['sensitivity']) == {}
+    assert log == []
+    assert lockin.configure({'fast_buffer.length': 1000, 'fast_buffer.enabled': True}) == {'fast_buffer.length': 1000}
+    assert log == ['fast_buffer.length']
+
+
+def test_failed_write_drops_the_mirror():
+    fail = set()
+    lockin, log = recorded_lockin(fail)
+    lockin.prepare_run()
+    fail.add('sensitivity')
+    with pytest.raises(ConnectionError):
+        lockin.set_sensitivity(2e-3)
+    assert lockin.settings == {} and lockin.device is None
+    # every setting is sent again on the new connection
+    fail.clear()
+    del log[:]
+    lockin.acquire()
+    assert sorted(log) == ['fast_buffer.enabled', 'fast_buffer.length', 'fast_buffer.storage_interval']
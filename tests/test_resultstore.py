@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from resultstore import ResultCube, save_cube
+
+
+@pytest.fixture
+def cube(tmp_path):
+    x_steps, y_steps, wavelengths = np.arange(13.0), np.arange(10.0), np.array([500.0, 600.0])
+    # smooth in x and y so that the block means of the previews are close to the samples of the full data
+    values = (x_steps[:, None, None] + 2 * y_steps[None, :, None]) * np.ones(len(wavelengths))
+    return ResultCube(save_cube(str(tmp_path / "run"), wavelengths, x_steps, y_steps, {'signal': values}))
+
+
+@pytest.mark.parametrize('step', [1, 2, 3, 4, 5, 6, 8])
+def test_preview_map_matches_full_data(cube, step):
+    full = np.array(cube.data('signal')[::step, ::step, 1])
+    assert cube.wavelength_map(1, step=step).shape == full.shape
+    # block means are offset from the samples by at most half a block in x and y
+    factor = max([factor for factor in cube.metadata['previews'] if step % factor == 0], default=1)
+    assert np.nanmax(np.abs(cube.wavelength_map(1, step=step) - full)) <= 1.5 * (factor - 1) + 1e-9
+
+
+def test_extras_are_saved_as_they_are(tmp_path):
+    x_steps, y_steps, wavelengths = np.arange(8.0), np.arange(8.0), np.array([500.0])
+    signal = np.ones((8, 8, 1))
+    flags = np.arange(64, dtype='u1').reshape(8, 8, 1)
+    cube = ResultCube(save_cube(str(tmp_path / "run"), wavelengths, x_steps, y_steps, {'signal': signal},
+                                extras={'flags': flags}))
+    assert cube.quantities == ['signal'] and cube.extras == ['flags']
+    assert cube.data('flags').dtype == np.uint8
+    assert not list(tmp_path.glob("run.cube/flags_preview*"))
+    # a map of an extra field is sampled from the full data even when the signal has previews
+    assert cube.metadata['previews']
+    assert np.array_equal(cube.wavelength_map(0, 'flags', step=2), flags[::2, ::2, 0])
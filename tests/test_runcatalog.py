@@ -0,0 +1,81 @@
+import os
+import threading
+
+import pytest
+
+import runcatalog
+from runcatalog import RunCatalog
+from simrig import SimulatedRig
+from test_simrig import make_job
+
+HEADER = "Wavelength (nm),X step (mm),Y step (mm),Signal (mV),Signal std (mV)\n"
+
+
+def write_run(folder, file_name, wavelengths, signal=1.0):
+    rows = "".join(f"{wavelength}, 0.0, 0.0, {signal}, 0.01\n" for wavelength in wavelengths)
+    (folder / file_name).write_text(HEADER + rows)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    write_run(tmp_path, "20240101-120000_VPHG1.csv", range(400, 700, 100))
+    write_run(tmp_path, "20240102-120000_VPHG2.csv", range(800, 1200, 100))
+    catalog = RunCatalog(str(tmp_path))
+    yield catalog
+    catalog.close()
+
+
+def test_update_only_reads_new_and_changed_files(catalog, tmp_path, monkeypatch):
+    assert catalog.update() == 2
+    read = []
+    summarise = runcatalog.summarise
+    monkeypatch.setattr(runcatalog, 'summarise', lambda folder, name: read.append(name) or summarise(folder, name))
+    # unchanged files are not read again
+    assert catalog.update() == 0 and read == []
+    # a changed file is read again, a deleted file is removed
+    path = tmp_path / "20240101-120000_VPHG1.csv"
+    write_run(tmp_path, path.name, range(400, 700, 100), signal=2.0)
+    os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 10))
+    os.remove(tmp_path / "20240102-120000_VPHG2.csv")
+    assert catalog.update() == 1 and read == [path.name]
+    runs = catalog.find()
+    assert [run['name'] for run in runs] == ["VPHG1"] and runs[0]['signal_mean'] == 2.0
+
+
+def test_find_wavelength_bands(catalog):
+    catalog.update()
+    assert [run['name'] for run in catalog.find(wavelength=550)] == ["VPHG1"]
+    assert [run['name'] for run in catalog.find(wavelength=(550, 850))] == ["VPHG1", "VPHG2"]
+    assert catalog.find(wavelength=(700, 750)) == []
+    assert [run['name'] for run in catalog.find(name="VPHG%", wavelength=(1000, 2000))] == ["VPHG2"]
+    # the file name holds the run name, not the grating ID
+    assert catalog.find(grating_id="VPHG1") == []
+
+
+def test_scans_catalogued_after_the_instruments_are_released(tmp_path, monkeypatch):
+    rig = SimulatedRig("B", seed=1)
+    free = []
+    update = RunCatalog.update
+
+    def try_lock():
+        free.append(rig.hardware_lock.acquire(blocking=False))
+        if free[-1]:
+            rig.hardware_lock.release()
+
+    def check_lock(catalog):
+        # the lock is an RLock, so it is tried from another thread
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        return update(catalog)
+    monkeypatch.setattr(RunCatalog, 'update', check_lock)
+    rig.run_scan(make_job(tmp_path), output=lambda message: None)
+    rig.run_scan(make_job(tmp_path, file_name="grating", grating_id="VPHG-01"), output=lambda message: None)
+    assert free == [True, True]
+
+    catalog = RunCatalog(str(tmp_path))
+    runs = {run['name']: run for run in catalog.find()}
+    catalog.close()
+    # the run name is taken from the metadata without the rig name, and there is no grating ID to fall back on
+    assert runs['scan']['grating_id'] is None
+    assert runs['grating']['grating_id'] == "VPHG-01"
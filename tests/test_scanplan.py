@@ -0,0 +1,46 @@
+import pytest
+
+from scanplan import CostModel, ScanPlan
+
+
+def test_limits_only_checked_when_configured():
+    plan = ScanPlan.from_entries("200", "3000", "100", "10", "20", "", "")
+    assert plan.validate() == []
+    problems = plan.validate(travel_limits=(-50, 50), wavelength_range=(250, 2500))
+    assert len(problems) == 2
+    assert "X positions 0 to 190 mm" in problems[0]
+    assert "Wavelengths 200 to 2900 nm" in problems[1]
+
+
+def test_scan_order_kept_without_switch_over_table():
+    plan = ScanPlan.from_entries("400", "1200", "100", "", "", "", "", current_wavelength=1100)
+    assert list(plan.order) == list(range(8))
+    assert plan.features()['switches'] == 0
+
+
+def test_bands_visited_in_one_sweep():
+    plan = ScanPlan.from_entries("400", "1200", "100", "", "", "", "", switch_wavelengths=(600, 1000),
+                                 current_wavelength=1100)
+    # from the top band down, so each grating or filter change is made once
+    assert list(plan.wavelengths[plan.order]) == [1100, 1000, 900, 800, 700, 600, 500, 400]
+    assert plan.features()['switches'] == 2
+
+
+@pytest.mark.parametrize('accuracy', ["-0.01", "0", "1", "2", "fast", ""])
+def test_invalid_settling_accuracy(accuracy):
+    with pytest.raises(ValueError, match="Settling accuracy"):
+        ScanPlan.from_entries("400", "1200", "100", "", "", "", "", settle_accuracy=accuracy)
+
+
+def test_settling_is_a_known_cost(tmp_path):
+    plan = ScanPlan.from_entries("400", "1200", "100", "1", "3", "", "")
+    slow = ScanPlan.from_entries("400", "1200", "100", "1", "3", "", "", settle_time=2.0)
+    model = CostModel()
+    assert model.estimate(slow) == pytest.approx(model.estimate(plan) + len(slow) * 2.0)
+
+    # runs with very different time constants, each twice as slow as the default costs apart from settling
+    model = CostModel(str(tmp_path / "run_timings.json"))
+    for settle_time in (0.1, 10.0):
+        run = ScanPlan.from_entries("400", "1200", "100", "1", "3", "", "", settle_time=settle_time)
+        model.record(run, 2 * CostModel().estimate(plan) + len(run) * settle_time)
+    assert model.estimate(slow) == pytest.approx(2 * CostModel().estimate(plan) + len(slow) * 2.0)
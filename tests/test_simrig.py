@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from jobqueue import ScanJob
+from orchestrator import Orchestrator
+from rig import load_bench
+from simrig import SimulatedRig, SimulatedSR7230
+
+
+def make_job(folder, **settings):
+    return ScanJob({'wavelength_start': "800", 'wavelength_stop': "1300", 'wavelength_step': "100",
+                    'x_step_size': "1", 'x_step_number': "2", 'y_step_size': "1", 'y_step_number': "2",
+                    'root_folder': str(folder), 'file_name': "scan", **settings})
+
+
+def test_simulated_scan(tmp_path):
+    rig = SimulatedRig("Bench 1", peak_wavelength=1000, seed=1)
+    result = rig.run_scan(make_job(tmp_path), output=lambda message: None)
+    data = result['data']
+    assert data.count == 5 * 2 * 2
+    assert np.all(np.isfinite(data.field('signal')))
+    # the model grating peaks at 1000 nm
+    assert result['wavelengths'][np.argmax(data.spectrum(0, 0))] == 1000
+    assert (tmp_path / result['filename'].split('/')[-1]).exists()
+    # the stages are returned to the start of the scan
+    assert rig.x_stage.position() == 0 and rig.y_stage.position() == 0
+
+
+def test_orchestrator_isolates_failures(tmp_path):
+    good = SimulatedRig("A", seed=1)
+    bad = SimulatedRig("B", seed=2, fail_after=3)
+    orchestrator = Orchestrator([good, bad], queue_folder=str(tmp_path), echo=False)
+    orchestrator.submit("A", make_job(tmp_path, file_name="a"))
+    orchestrator.submit("B", make_job(tmp_path, file_name="b1"))
+    orchestrator.submit("B", make_job(tmp_path, file_name="b2"))
+    assert sorted(orchestrator.start()) == ["A", "B"]
+    assert orchestrator.wait(timeout=60)
+
+    status = {row['rig']: row for row in orchestrator.status()}
+    assert status['A']['done'] == 1 and status['A']['failed'] == 0
+    # the lock-in of B stops responding in its first scan, B moves on to its next scan which also fails
+    assert status['B']['failed'] == 2 and status['B']['done'] == 0
+    assert "not responding" in status['B']['last_error']
+    assert [job.status for job in orchestrator.queues['A'].jobs] == ['done']
+
+
+def test_rigs_sharing_a_folder_write_separate_files(tmp_path):
+    rigs = [SimulatedRig("Bench 1", seed=1), SimulatedRig("Bench 2", seed=2)]
+    orchestrator = Orchestrator(rigs, queue_folder=str(tmp_path), echo=False)
+    for rig in rigs:
+        orchestrator.submit(rig.name, make_job(tmp_path, file_name="same"))
+    orchestrator.start()
+    assert orchestrator.wait(timeout=60)
+
+    for rig in rigs:
+        csv_files = list(tmp_path.glob(f"*{rig.file_tag}_same.csv"))
+        cubes = list(tmp_path.glob(f"*{rig.file_tag}_same.cube"))
+        assert len(csv_files) == 1 and len(cubes) == 1
+        # header and one line per point
+        assert len(csv_files[0].read_text().splitlines()) == 1 + 5 * 2 * 2
+        assert (tmp_path / f"scan_queue{rig.file_tag}.json").exists()
+
+
+class FlakySR7230(SimulatedSR7230):
+    # Lock-in that drops the connection when the sensitivity is set while fail is True
+    fail = False
+
+    @property
+    def sensitivity(self):
+        return self._sensitivity
+
+    @sensitivity.setter
+    def sensitivity(self, value):
+        if FlakySR7230.fail:
+            FlakySR7230.fail = False
+            raise ConnectionError("Simulated lock-in dropped the connection")
+        self._sensitivity = value
+
+
+def test_failed_gain_preset_is_reported(tmp_path):
+    rig = SimulatedRig("Bench 1", peak_wavelength=850, seed=1)
+    rig.lockin.open_device = lambda address: FlakySR7230(rig.bench, address)
+    # the first scan fills the gain map, the second presets the lock-in from it
+    rig.run_scan(make_job(tmp_path), output=lambda message: None)
+    # start the second scan at a different sensitivity so that the preset is sent
+    rig.lockin.set_sensitivity(1.0)
+    messages = []
+    FlakySR7230.fail = True
+    result = rig.run_scan(make_job(tmp_path), output=messages.append)
+    assert not FlakySR7230.fail
+    assert any(message.startswith("Lock-in sensitivity preset") for message in messages)
+    # the readings are still scaled to the sensitivity at the start of the run, so the spectrum has the model shape
+    spectrum = result['data'].spectrum(0, 0)
+    model = np.exp(-0.5 * ((result['wavelengths'] - 850) / 200) ** 2)
+    assert np.allclose(spectrum / spectrum.max(), model / model.max(), rtol=0.02)
+
+
+def test_invalid_settings_rejected_before_the_instruments_are_used(tmp_path):
+    rig = SimulatedRig("Bench 1", seed=1)
+    with pytest.raises(ValueError, match="Settling accuracy"):
+        rig.run_scan(make_job(tmp_path, settle_accuracy="-0.01", rotation1="10"), output=lambda message: None)
+    assert rig.bench.angles == {} and rig.x_stage.ser is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_loaded_bench_checks_its_limits(tmp_path):
+    rig_file = tmp_path / "rig.json"
+    rig_file.write_text('[{"name": "Bench 1", "travel_limits": [-5, 5], "wavelength_range": [300, 1100]}]')
+    rig = load_bench(str(rig_file))
+    assert rig.unchecked_limits() == []
+    problems = rig.validate_plan(rig.build_plan(make_job(tmp_path, x_step_size="10")))
+    assert len(problems) == 2
+    # without a rig file the default rig is used and the limits it cannot check are reported
+    assert len(load_bench(str(tmp_path / "missing.json")).unchecked_limits()) == 2
+
+
+def test_loaded_bench_orders_wavelengths_by_its_switch_over_table(tmp_path):
+    rig_file = tmp_path / "rig.json"
+    rig_file.write_text('[{"name": "Bench 1", "switch_wavelengths": [1000]}]')
+    rig = load_bench(str(rig_file))
+    assert rig.monochromator.switch_wavelengths == (1000,)
+    # the monochromator is in the upper band, which is measured first, so the grating is changed once
+    rig.monochromator.wavelength = 1250
+    plan = rig.build_plan(make_job(tmp_path))
+    assert list(plan.wavelengths[plan.order]) == [1200, 1100, 1000, 900, 800]
+    assert plan.features()['switches'] == 1
+
+
+def test_readings_after_a_run_are_not_scaled(tmp_path):
+    rig = SimulatedRig("Bench 1", seed=1)
+    rig.run_scan(make_job(tmp_path, gain_ranging=1), output=lambda message: None)
+    # an I/O error after the run leaves the sensitivity unknown, later readings still work and are not scaled
+    rig.lockin.disconnect()
+    rig.lockin.set_sensitivity(5e-3)
+    for _ in range(3):
+        signal, _ = rig.acquisition(autorange=False)
+        assert np.isfinite(signal)
+    assert rig.lockin.sensitivity_scale() == 1.0
@@ -0,0 +1,98 @@
+import pytest
+
+from simrig import SimulatedAPT, SimulatedBench, SimulatedSerial
+from stagecontrol import RotationStages, TranslationStage
+
+
+def test_rotation_stages_chosen_by_serial_number():
+    bench = SimulatedBench()
+    apt = SimulatedAPT(bench, serial_numbers=(1, 2, 3, 4))
+    first = RotationStages(apt=apt)
+    second = RotationStages(apt=apt, serial_numbers=[4, 3])
+    first.move_to(0, 11)
+    second.move_to(0, 22)
+    second.move_to(1, 33)
+    assert first.serial_number(0) == 1 and first.serial_number(1) == 2
+    assert second.serial_number(0) == 4 and second.serial_number(1) == 3
+    assert bench.angles == {1: 2.0, 2: 0.0, 4: 4.0, 3: 6.0}
+
+
+def test_missing_rotation_stage():
+    stages = RotationStages(apt=SimulatedAPT(SimulatedBench(), serial_numbers=(1, 2)), serial_numbers=[1, 7])
+    assert stages.serial_number(0) == 1
+    with pytest.raises(IndexError):
+        stages.motor(1)
+
+
+class StaleMotor:
+    # Motor handle of a stage that has been reconnected
+    def move_to(self, value, blocking=False):
+        raise OSError("APT device not responding")
+
+
+def test_retry_opens_a_new_motor():
+    bench = SimulatedBench()
+    apt = SimulatedAPT(bench, serial_numbers=(1, 2))
+    stages = RotationStages(apt=apt)
+    stages.refresh()
+    stages.motors[1] = StaleMotor()
+    stages.move_to(0, 11)
+    assert bench.angles[1] == 2.0
+    assert not isinstance(stages.motors[1], StaleMotor)
+
+
+class CountingSerial(SimulatedSerial):
+    # Simulated controller that keeps the commands written to it
+    def __init__(self, bench, port, **options):
+        super().__init__(bench, port, **options)
+        self.commands = []
+
+    def write(self, data):
+        self.commands.append(data.decode().strip())
+        return super().write(data)
+
+
+def make_stage(bench):
+    ports = []
+
+    def open_port(port, **options):
+        ports.append(CountingSerial(bench, port, **options))
+        return ports[-1]
+    stage = TranslationStage('COM4', steps_per_mm=8.0, open_port=open_port)
+    stage.connect()
+    return stage, ports[0].commands
+
+
+def test_moves_are_absolute_from_the_cached_position():
+    bench = SimulatedBench()
+    bench.positions['x'] = 16.0
+    stage, commands = make_stage(bench)
+    # the position is read once on connection
+    assert commands == ['P'] and stage.position() == 2.0
+    assert stage.move_to(3.0) == 1.0
+    assert stage.move_by(-0.5) == 0.5
+    assert commands[1:] == ['MA 24.0', 'MA 20.0']
+    assert bench.positions['x'] == 20.0
+
+
+def test_moves_to_the_current_position_are_skipped():
+    stage, commands = make_stage(SimulatedBench())
+    stage.move_to(1.0)
+    del commands[:]
+    assert stage.move_to(1.0) == 0.0
+    assert stage.move_by(0) == 0.0
+    assert commands == []
+
+
+def test_relative_moves_do_not_drift():
+    bench = SimulatedBench()
+    stage, commands = make_stage(bench)
+    for _ in range(1000):
+        stage.move_by(0.1)
+    for _ in range(1000):
+        stage.move_by(-0.1)
+    # every move is an absolute command, so the rounding of each step does not accumulate
+    assert all(command.startswith('MA ') for command in commands[1:])
+    assert stage.position() == pytest.approx(0.0, abs=1e-9)
+    assert bench.positions['x'] == pytest.approx(0.0, abs=1e-9)
+    assert stage.checkpoint() == pytest.approx(0.0, abs=1e-6)